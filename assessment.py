@@ -0,0 +1,106 @@
+"""Adaptive initial assessment.
+
+The level only depends on which band the total score falls in. After each
+graded answer the lowest and the highest total the user can still reach are
+known: answered questions count with their verdict, the rest as either all
+wrong or all right. Once both ends fall in the same band the level can't
+change any more, so the remaining questions are skipped.
+
+Which question comes next is up to a policy:
+- fixed: the order the questions are listed in
+- weight: heaviest first, which narrows the range of reachable scores fastest
+- staircase: a heavier question after a right answer, a lighter one after a
+  wrong answer, starting from the middle weight
+"""
+import os
+from typing import List, Optional, Sequence, Tuple
+
+# upper score of each level, in increasing order
+LEVEL_BANDS = ((4, 'beginner'), (12, 'intermediate'), (float('inf'), 'advanced'))
+POLICIES = ('fixed', 'weight', 'staircase')
+
+# (question index, verdict) in the order the questions were asked; a verdict
+# of None means the answer couldn't be graded and doesn't count
+Results = Sequence[Tuple[int, Optional[int]]]
+
+
+def level_by_score(score: int) -> str:
+    for upper, level in LEVEL_BANDS:
+        if score <= upper:
+            return level
+
+
+class AdaptiveAssessment:
+    """Chooses assessment questions and decides when the level is settled.
+
+    It keeps no state of its own: callers pass in the verdicts so far and the
+    questions still being graded, so the progress can live in user_data.
+    """
+
+    def __init__(self, questions: List[Tuple[str, int]], policy: str = 'weight',
+                 early_stop: bool = True, min_questions: int = 0):
+        """
+        :param questions: (question, weight) pairs
+        :param policy: How the next question is chosen, one of POLICIES
+        :param early_stop: Stop as soon as the level is settled, instead of asking every question
+        :param min_questions: Ask at least this many questions before stopping early
+        """
+        if policy not in POLICIES:
+            raise ValueError(f"unknown assessment policy {policy!r}, expected one of {POLICIES}")
+        self.questions = questions
+        self.weights = [weight for _, weight in questions]
+        self.policy = policy
+        self.early_stop = early_stop
+        self.min_questions = min_questions
+
+    @classmethod
+    def from_env(cls, questions: List[Tuple[str, int]]) -> 'AdaptiveAssessment':
+        return cls(questions,
+                   policy=os.getenv('ASSESSMENT_POLICY', 'weight'),
+                   early_stop=os.getenv('ASSESSMENT_EARLY_STOP', '1') == '1',
+                   min_questions=int(os.getenv('ASSESSMENT_MIN_QUESTIONS', 0)))
+
+    def score(self, results: Results) -> int:
+        return sum(self.weights[index] for index, verdict in results if verdict == 1)
+
+    def bounds(self, results: Results) -> Tuple[int, int]:
+        """Lowest and highest total score still reachable."""
+        graded = {index for index, _ in results}
+        low = self.score(results)
+        return low, low + sum(weight for index, weight in enumerate(self.weights) if index not in graded)
+
+    def decided_level(self, results: Results, pending: Sequence[int] = ()) -> Optional[str]:
+        """The level if the remaining answers can't change it, otherwise None.
+
+        :param pending: Questions answered but not graded yet
+        """
+        asked = len(results) + len(pending)
+        if asked < len(self.questions) and (not self.early_stop or asked < self.min_questions):
+            return None
+
+        low, high = self.bounds(results)
+        level = level_by_score(low)
+        return level if level == level_by_score(high) else None
+
+    def next_question(self, results: Results, pending: Sequence[int] = ()) -> Optional[int]:
+        """Index of the question to ask next, or None if every question was asked."""
+        asked = {index for index, _ in results} | set(pending)
+        remaining = [index for index in range(len(self.questions)) if index not in asked]
+        if not remaining:
+            return None
+
+        if self.policy == 'fixed':
+            return remaining[0]
+        if self.policy == 'weight':
+            return max(remaining, key=lambda index: self.weights[index]) # first of the heaviest
+
+        weights = sorted(set(self.weights))
+        if results:
+            last, verdict = results[-1]
+            step = 1 if verdict == 1 else -1
+            position = weights.index(self.weights[last]) + step
+            target = weights[min(max(position, 0), len(weights) - 1)]
+        else:
+            target = weights[len(weights) // 2]
+        return min(remaining, key=lambda index: abs(self.weights[index] - target))
+
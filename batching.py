@@ -0,0 +1,101 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, List, Tuple
+
+
+class BatchParseError(ValueError):
+    """Raised when a batched grading reply can't be mapped back to its items."""
+
+
+class GradingBatcher:
+    """Coalesces concurrent grading requests into batched LLM calls.
+
+    Answers submitted within `window` seconds of each other, up to `max_batch`
+    of them, are graded together with a single `grade_batch` call. If the
+    batched reply can't be parsed, each item is graded on its own with
+    `grade_one` instead. Identical (question, answer) pairs in a batch are
+    graded once.
+    """
+
+    def __init__(self,
+                 grade_batch: Callable[[List[Tuple[str, str]]], Awaitable[List[int]]],
+                 grade_one: Callable[[str, str], Awaitable[int]],
+                 window: float = 0.05,
+                 max_batch: int = 16):
+        """
+        :param grade_batch: Grades a list of (question, answer) pairs, returning one verdict per pair
+        :param grade_one: Grades a single (question, answer) pair
+        :param window: How long to wait for more answers before sending a batch, in seconds
+        :param max_batch: Batch size that triggers an immediate send
+        """
+        self.grade_batch = grade_batch
+        self.grade_one = grade_one
+        self.window = window
+        self.max_batch = max_batch
+
+        self._pending = [] # (question, answer, future)
+        self._timer = None
+        self._tasks = set()
+
+    async def submit(self, question: str, answer: str) -> int:
+        """Queue an answer for grading and wait for its verdict."""
+        if self.max_batch <= 1:
+            return await self.grade_one(question, answer)
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((question, answer, future))
+
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+
+        return await future
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+
+        task = asyncio.create_task(self._run(batch))
+        self._tasks.add(task) # keep a reference until the batch is done
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch) -> None:
+        items = list(dict.fromkeys((question, answer) for question, answer, _ in batch))
+
+        try:
+            if len(items) == 1:
+                verdicts = [await self.grade_one(*items[0])]
+            else:
+                verdicts = await self._grade_batch_or_fallback(items)
+        except Exception as e:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        by_item = dict(zip(items, verdicts))
+        for question, answer, future in batch:
+            verdict = by_item[question, answer]
+            if future.done(): # the caller gave up waiting
+                continue
+            if isinstance(verdict, BaseException):
+                future.set_exception(verdict)
+            else:
+                future.set_result(verdict)
+
+    async def _grade_batch_or_fallback(self, items):
+        try:
+            verdicts = await self.grade_batch(items)
+        except BatchParseError as e:
+            logging.warning(f"Batched grading of {len(items)} answers failed ({e}), grading one by one")
+            return await asyncio.gather(*(self.grade_one(q, a) for q, a in items),
+                                        return_exceptions=True)
+
+        return verdicts
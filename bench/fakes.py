@@ -0,0 +1,300 @@
+"""Local stand-ins for the Telegram Bot API and Cohere's chat endpoint.
+
+Both run on a background thread so a bot under test can talk to them over
+real HTTP. Point the bot at them with TELEGRAM_BASE_URL and COHERE_BASE_URL.
+"""
+import json
+import random
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+
+class _FakeServer:
+    def __init__(self, host: str = '127.0.0.1', port: int = 0):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                body = self.rfile.read(length)
+                status, payload, headers = fake.handle(self.path, self.headers, body)
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+
+                try:
+                    if isinstance(payload, bytes):
+                        self.send_header('Content-Length', str(len(payload)))
+                        self.end_headers()
+                        self.wfile.write(payload)
+                        return
+
+                    # a stream of chunks, delimited by closing the connection
+                    self.send_header('Connection', 'close')
+                    self.end_headers()
+                    self.close_connection = True
+                    for chunk in payload:
+                        self.wfile.write(chunk)
+                        self.wfile.flush()
+                except ConnectionError: # the client gave up, e.g. a cancelled hedged request
+                    self.close_connection = True
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.host, self.port = self.httpd.server_address[:2]
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def handle(self, path, headers, body):
+        raise NotImplementedError
+
+
+class FakeTelegramServer(_FakeServer):
+    """Minimal Bot API: serves queued updates through getUpdates and records what the bot sends.
+
+    Once the bot calls setWebhook, updates are posted to the webhook instead,
+    with the secret token header and at most `max_connections` at a time.
+
+    `on_message(chat_id, text, message_id, edited)` is called from a server
+    thread for every sendMessage and editMessageText.
+    """
+
+    BOT_USER = {"id": 1, "is_bot": True, "first_name": "FakeBot", "username": "fake_bot"}
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, on_message=None):
+        super().__init__(host, port)
+        self.on_message = on_message
+        self.requests = 0
+        self._updates = []
+        self._next_update_id = 1
+        self._next_message_id = 1
+        self._cond = threading.Condition()
+        self._webhook = None # (url, secret token)
+        self._webhook_pool = None
+        self.webhook_errors = 0
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}/bot"
+
+    def push_update(self, update: dict) -> int:
+        """Queue or post an update for the bot; `update_id` is filled in."""
+        with self._cond:
+            update['update_id'] = self._next_update_id
+            self._next_update_id += 1
+            if self._webhook is None:
+                self._updates.append(update)
+                self._cond.notify_all()
+            else:
+                self._webhook_pool.submit(self._post_update, *self._webhook, update)
+        return update['update_id']
+
+    def stop(self):
+        if self._webhook_pool is not None:
+            self._webhook_pool.shutdown(wait=False, cancel_futures=True)
+        super().stop()
+
+    def _post_update(self, url, secret_token, update):
+        request = urllib.request.Request(url, data=json.dumps(update).encode(), method='POST',
+                                         headers={'Content-Type': 'application/json'})
+        if secret_token:
+            request.add_header('X-Telegram-Bot-Api-Secret-Token', secret_token)
+        try:
+            urllib.request.urlopen(request, timeout=10).close()
+        except OSError:
+            self.webhook_errors += 1
+
+    def new_message_id(self) -> int:
+        with self._cond:
+            message_id = self._next_message_id
+            self._next_message_id += 1
+        return message_id
+
+    def handle(self, path, headers, body):
+        self.requests += 1
+        method = path.rsplit('/', 1)[-1]
+        params = self._parse_params(headers.get('Content-Type', ''), body)
+
+        handler = getattr(self, f'_api_{method}', None)
+        result = handler(params) if handler else True
+        payload = json.dumps({"ok": True, "result": result}).encode()
+        return 200, payload, {'Content-Type': 'application/json'}
+
+    @staticmethod
+    def _parse_params(content_type, body):
+        if not body:
+            return {}
+        if 'application/json' in content_type:
+            return json.loads(body)
+
+        params = {}
+        for key, values in parse_qs(body.decode()).items():
+            try:
+                params[key] = json.loads(values[0]) # python-telegram-bot JSON-encodes every field
+            except ValueError:
+                params[key] = values[0]
+        return params
+
+    def _api_getMe(self, params):
+        return self.BOT_USER
+
+    def _api_setWebhook(self, params):
+        with self._cond:
+            self._webhook = (params['url'], params.get('secret_token'))
+            if self._webhook_pool is None:
+                self._webhook_pool = ThreadPoolExecutor(int(params.get('max_connections', 40)))
+        return True
+
+    def _api_deleteWebhook(self, params):
+        with self._cond:
+            self._webhook = None
+        return True
+
+    def _api_getUpdates(self, params):
+        offset = int(params.get('offset', 0))
+        timeout = float(params.get('timeout', 0))
+        limit = int(params.get('limit', 100))
+        deadline = time.monotonic() + timeout
+
+        with self._cond:
+            self._updates = [u for u in self._updates if u['update_id'] >= offset]
+            while not self._updates:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            return self._updates[:limit]
+
+    def _api_sendMessage(self, params):
+        message_id = self.new_message_id()
+        return self._message(params, message_id, edited=False)
+
+    def _api_editMessageText(self, params):
+        return self._message(params, int(params['message_id']), edited=True)
+
+    def _message(self, params, message_id, edited):
+        chat_id = int(params['chat_id'])
+        text = params.get('text', '')
+        if self.on_message:
+            self.on_message(chat_id, text, message_id, edited)
+
+        return {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": self.BOT_USER,
+            "text": text,
+        }
+
+
+class FakeCohereServer(_FakeServer):
+    """Fake /v2/chat endpoint with configurable latency, error rate and verdicts.
+
+    Grading requests get "1" or "0" at random (`correct_rate`); batched grading
+    requests get one verdict per item; anything else gets a canned answer.
+    Streaming requests get the reply as server-sent events, one word at a time.
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0,
+                 latency: float = 0.5, jitter: float = 0.2,
+                 error_rate: float = 0.0, correct_rate: float = 0.6,
+                 token_interval: float = 0.02, slow_rate: float = 0.0, slow_latency: float = 10.0,
+                 verbose_rate: float = 0.0):
+        """
+        :param latency: Mean response time in seconds, or time to the first word when streaming
+        :param jitter: Response times are spread uniformly over latency +/- jitter
+        :param error_rate: Fraction of requests answered with a 429 or 503
+        :param correct_rate: Fraction of answers graded as correct
+        :param token_interval: Seconds between streamed words
+        :param slow_rate: Fraction of requests that take `slow_latency` seconds instead, to exercise hedging
+        :param verbose_rate: Fraction of grading replies wrapped in prose, e.g. "Verdict: 1 (correct)"
+        """
+        super().__init__(host, port)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.correct_rate = correct_rate
+        self.token_interval = token_interval
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.verbose_rate = verbose_rate
+        self.requests = 0
+        self.errors = 0
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def handle(self, path, headers, body):
+        self.requests += 1
+        if random.random() < self.slow_rate:
+            time.sleep(self.slow_latency)
+        else:
+            time.sleep(max(0.0, random.uniform(self.latency - self.jitter, self.latency + self.jitter)))
+
+        if random.random() < self.error_rate:
+            self.errors += 1
+            status = random.choice([429, 503])
+            return status, json.dumps({"message": "fake failure"}).encode(), {'Content-Type': 'application/json'}
+
+        request = json.loads(body)
+        text = self._reply(request)
+        if request.get('stream'):
+            return 200, self._stream(text), {'Content-Type': 'text/event-stream'}
+
+        response = {
+            "id": "fake",
+            "finish_reason": "COMPLETE",
+            "message": {"role": "assistant", "content": [{"type": "text", "text": text}]},
+            "usage": {"billed_units": {"input_tokens": 1, "output_tokens": 1}},
+        }
+        return 200, json.dumps(response).encode(), {'Content-Type': 'application/json'}
+
+    def _stream(self, text):
+        def event(data):
+            return f"data: {json.dumps(data)}\n\n".encode()
+
+        yield event({"type": "message-start", "id": "fake", "delta": {"message": {"role": "assistant"}}})
+        yield event({"type": "content-start", "index": 0,
+                     "delta": {"message": {"content": {"type": "text", "text": ""}}}})
+        for i, word in enumerate(text.split(' ')):
+            if i:
+                time.sleep(self.token_interval)
+            piece = word if i == 0 else ' ' + word
+            yield event({"type": "content-delta", "index": 0,
+                         "delta": {"message": {"content": {"text": piece}}}})
+        yield event({"type": "content-end", "index": 0})
+        yield event({"type": "message-end", "delta": {"finish_reason": "COMPLETE"}})
+
+    def _verdict(self) -> int:
+        return 1 if random.random() < self.correct_rate else 0
+
+    def _reply(self, request) -> str:
+        messages = request.get('messages', [])
+        system = next((m['content'] for m in messages if m['role'] == 'system'), '')
+        user = messages[-1]['content'] if messages else ''
+
+        if 'verdicts' in system:
+            return json.dumps({"verdicts": [self._verdict() for _ in json.loads(user)]})
+        if 'evaluates' in system:
+            verdict = self._verdict()
+            if random.random() < self.verbose_rate:
+                return f"Verdict: {verdict} ({'correct' if verdict else 'incorrect'})"
+            return f"{verdict}."
+        return f"A short fake answer to: {user[:50]}"
@@ -0,0 +1,274 @@
+"""End-to-end load test of TelegramBot against local fakes of Telegram and Cohere.
+
+Simulated users run /start, take the initial assessment, set their task
+interval, and answer the daily task sent by a scheduler run. Latency is
+measured from the moment an update is queued until the bot's first reply.
+
+    python bench/load_test.py --users 1000 --concurrency 200 --llm-latency 0.5
+
+With --webhook the bot runs its webhook server and the fake Telegram posts
+updates to it instead of serving them through getUpdates.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import socket
+import statistics
+import sys
+import tempfile
+import time
+import types
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from fakes import FakeCohereServer, FakeTelegramServer
+
+
+class SimulatedUsers:
+    """Sends updates on behalf of users and collects the bot's replies per chat."""
+
+    def __init__(self, telegram: FakeTelegramServer, loop: asyncio.AbstractEventLoop, step_timeout: float,
+                 think_time: float = 0.1):
+        self.telegram = telegram
+        self.loop = loop
+        self.step_timeout = step_timeout
+        # a conversation moves to its next state only once the handler returns, which can be
+        # just after its last reply arrives; real users never answer that fast
+        self.think_time = think_time
+        self.inbox = {} # chat_id -> asyncio.Queue of (text, message_id)
+        self.latencies = {} # step -> list of seconds
+        self.updates_sent = 0
+        self.timeouts = 0
+
+    def on_message(self, chat_id, text, message_id, edited):
+        queue = self.inbox.get(chat_id)
+        if queue is not None:
+            self.loop.call_soon_threadsafe(queue.put_nowait, (text, message_id))
+
+    def _user(self, user_id: int) -> dict:
+        return {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"}
+
+    def send_text(self, user_id: int, text: str) -> None:
+        message = {
+            "message_id": self.telegram.new_message_id(),
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": self._user(user_id),
+            "text": text,
+        }
+        if text.startswith('/'):
+            command = text.split()[0]
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(command)}]
+
+        self.updates_sent += 1
+        self.telegram.push_update({"message": message})
+
+    def press(self, user_id: int, data: str, message_id: int) -> None:
+        self.updates_sent += 1
+        self.telegram.push_update({"callback_query": {
+            "id": str(self.telegram.new_message_id()),
+            "from": self._user(user_id),
+            "chat_instance": str(user_id),
+            "data": data,
+            "message": {
+                "message_id": message_id,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": FakeTelegramServer.BOT_USER,
+                "text": "",
+            },
+        }})
+
+    async def expect(self, user_id: int, predicate=lambda text: True):
+        """Wait for the next bot message to this user that matches `predicate`."""
+        queue = self.inbox[user_id]
+        deadline = self.loop.time() + self.step_timeout
+        while True:
+            text, message_id = await asyncio.wait_for(queue.get(), deadline - self.loop.time())
+            if predicate(text):
+                return text, message_id
+
+    async def step(self, name: str, user_id: int, action, predicate=lambda text: True):
+        """Perform `action`, wait for a matching reply and record how long it took."""
+        await asyncio.sleep(self.think_time)
+        started = time.perf_counter()
+        action()
+        reply = await self.expect(user_id, predicate)
+        self.latencies.setdefault(name, []).append(time.perf_counter() - started)
+        return reply
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(p / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+async def onboard(sim: SimulatedUsers, user_id: int, questions: set):
+    sim.inbox[user_id] = asyncio.Queue()
+
+    _, message_id = await sim.step('start', user_id, lambda: sim.send_text(user_id, '/start'),
+                                   lambda text: 'assessment' in text)
+
+    def next_step(text):
+        return text in questions or text.startswith('Assessment completed')
+
+    text, _ = await sim.step('start_assessment', user_id, lambda: sim.press(user_id, 'start_assessment', message_id),
+                             next_step)
+    while not text.startswith('Assessment completed'):
+        # verdicts may arrive before or after the next question, so wait for the question itself
+        text, _ = await sim.step('assessment_answer', user_id,
+                                 lambda: sim.send_text(user_id, random.choice(['14', 'I am not sure'])),
+                                 next_step)
+
+    await sim.step('task_interval', user_id, lambda: sim.send_text(user_id, '/task_interval 1'),
+                   lambda text: text.startswith('You will get a task'))
+
+
+async def answer_daily_task(sim: SimulatedUsers, user_id: int):
+    await sim.expect(user_id, lambda text: 'daily Python challenge' in text)
+    await sim.step('daily_answer', user_id, lambda: sim.send_text(user_id, 'Some answer'),
+                   lambda text: 'Your new score is' in text)
+
+
+async def run_all(coros, concurrency: int, sim: SimulatedUsers):
+    limiter = asyncio.Semaphore(concurrency)
+
+    async def limited(coro):
+        async with limiter:
+            try:
+                await coro
+            except asyncio.TimeoutError:
+                sim.timeouts += 1
+
+    await asyncio.gather(*(limited(coro) for coro in coros))
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def db_size(path: str) -> int:
+    return sum(os.path.getsize(path + suffix) for suffix in ('', '-wal', '-shm')
+               if os.path.exists(path + suffix))
+
+
+async def main(args):
+    loop = asyncio.get_running_loop()
+
+    telegram = FakeTelegramServer().start()
+    cohere = FakeCohereServer(latency=args.llm_latency, jitter=args.llm_jitter,
+                              error_rate=args.llm_error_rate, slow_rate=args.llm_slow_rate,
+                              verbose_rate=args.llm_verbose_rate).start()
+    sim = SimulatedUsers(telegram, loop, args.step_timeout, args.think_time)
+    telegram.on_message = sim.on_message
+
+    workdir = tempfile.mkdtemp(prefix='bot-load-test-')
+    os.environ.update({
+        'DB_PATH': os.path.join(workdir, 'learning_bot.db'),
+        'BOT_TOKEN': '123456:fake',
+        'COHERE_API': 'fake',
+        'TELEGRAM_BASE_URL': telegram.url,
+        'COHERE_BASE_URL': cohere.url,
+        'SEND_RATE_LIMIT': str(args.send_rate),
+    })
+    if args.webhook:
+        port = free_port()
+        os.environ.update({
+            'WEBHOOK_URL': f'http://127.0.0.1:{port}/telegram',
+            'WEBHOOK_LISTEN': '127.0.0.1',
+            'WEBHOOK_PORT': str(port),
+            'WEBHOOK_SECRET': 'load-test-secret',
+        })
+
+    # imported late so they pick up the environment above
+    from constants import initial_asses_qs, beginner_questions, intermediate_questions, advanced_questions
+    from database import DataBaseOps, DB_PATH, ASSESSMENT_LEVEL
+    from tg_bot import TelegramBot
+
+    logging.getLogger().setLevel(logging.WARNING)
+    logging.getLogger('httpx').setLevel(logging.WARNING)
+
+    db = DataBaseOps()
+    db.insert_q([(q, ASSESSMENT_LEVEL) for q, _ in initial_asses_qs])
+    for questions in (beginner_questions, intermediate_questions, advanced_questions):
+        db.insert_q(questions)
+
+    bot = TelegramBot()
+    app = bot.application
+    await app.initialize()
+    if app.post_init:
+        await app.post_init(app)
+    for job in app.job_queue.jobs(): # the scheduler is run by hand below
+        job.schedule_removal()
+    await app.start()
+    webhook = bot.webhook_settings()
+    if webhook is None:
+        await app.updater.start_polling(poll_interval=0, timeout=5)
+    else:
+        await app.updater.start_webhook(**webhook)
+
+    user_ids = range(1_000_000, 1_000_000 + args.users)
+    questions = {q for q, _ in initial_asses_qs}
+    started = time.perf_counter()
+
+    print(f"Onboarding {args.users} users...")
+    await run_all([onboard(sim, uid, questions) for uid in user_ids], args.concurrency, sim)
+
+    print("Running the daily task scheduler...")
+    with db.db: # intervals are whole hours, so make every user's next task due now
+        db.db.execute('UPDATE users SET next_due_at = last_assessment')
+    scheduler_started = time.perf_counter()
+    await bot.send_daily_task(types.SimpleNamespace(bot=app.bot))
+    scheduler_time = time.perf_counter() - scheduler_started
+
+    await run_all([answer_daily_task(sim, uid) for uid in user_ids], args.concurrency, sim)
+    wall_time = time.perf_counter() - started
+
+    await app.updater.stop()
+    await app.stop()
+    await app.shutdown()
+    if app.post_shutdown:
+        await app.post_shutdown(app)
+    telegram.stop()
+    cohere.stop()
+
+    print()
+    print(f"Mode: {'webhook' if webhook else 'long polling'}")
+    print(f"Users: {args.users}  Wall time: {wall_time:.1f}s  Timed out sessions: {sim.timeouts}")
+    print(f"Updates sent: {sim.updates_sent}  Throughput: {sim.updates_sent / wall_time:.1f} updates/s")
+    print()
+    print(f"{'Handler latency (ms)':<22} {'count':>7} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8}")
+    for step, values in sim.latencies.items():
+        ms = [v * 1000 for v in values]
+        print(f"{step:<22} {len(ms):>7} {statistics.median(ms):>8.1f} {percentile(ms, 95):>8.1f} "
+              f"{percentile(ms, 99):>8.1f} {max(ms):>8.1f}")
+    print()
+    print(f"Scheduler run: {scheduler_time:.2f}s")
+    print(f"Telegram API requests: {telegram.requests}  Cohere requests: {cohere.requests} "
+          f"(errors: {cohere.errors})")
+    if telegram.webhook_errors:
+        print(f"Failed webhook deliveries: {telegram.webhook_errors}")
+    print(f"DB size: {db_size(DB_PATH) / 1024 / 1024:.2f} MB ({DB_PATH})")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Load test the bot against local Telegram and Cohere fakes.")
+    parser.add_argument('--users', type=int, default=200, help="number of simulated users")
+    parser.add_argument('--concurrency', type=int, default=100, help="users active at the same time")
+    parser.add_argument('--llm-latency', type=float, default=0.5, help="mean fake Cohere latency in seconds")
+    parser.add_argument('--llm-jitter', type=float, default=0.2, help="fake Cohere latency spread in seconds")
+    parser.add_argument('--llm-error-rate', type=float, default=0.0, help="fraction of fake Cohere calls that fail")
+    parser.add_argument('--llm-slow-rate', type=float, default=0.0, help="fraction of fake Cohere calls taking 10s")
+    parser.add_argument('--llm-verbose-rate', type=float, default=0.0,
+                        help="fraction of fake grading replies phrased as prose")
+    parser.add_argument('--send-rate', type=float, default=1000, help="daily task send rate limit, messages/s")
+    parser.add_argument('--think-time', type=float, default=0.1, help="pause before each user action in seconds")
+    parser.add_argument('--webhook', action='store_true', help="deliver updates through the bot's webhook")
+    parser.add_argument('--step-timeout', type=float, default=60, help="seconds to wait for any single reply")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,119 @@
+"""Offline replay of the initial assessment under each question policy.
+
+Every user who answered all assessment questions is replayed: questions are
+asked in the order the policy picks, with the verdicts the user actually got,
+until the level is settled. The script reports how many questions (and so LLM
+gradings) each policy needs and how often it ends at the same level as the full
+assessment, which with early stopping should always be 100%.
+
+    python bench/simulate_assessment.py --db learning_bot.db
+    python bench/simulate_assessment.py --synthetic 5000
+
+--lag N replays answers the way the pipelined assessment sees them: the next
+question is chosen while the last N answers are still being graded.
+"""
+import argparse
+import math
+import os
+import random
+import sqlite3
+import statistics
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from assessment import POLICIES, AdaptiveAssessment, level_by_score
+from constants import initial_asses_qs
+
+
+def recorded_verdicts(path: str) -> list:
+    """Verdict vectors of users who answered every assessment question, from their latest answers."""
+    db = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    rows = db.execute('''
+        SELECT a.user_id, q.question, a.is_correct
+        FROM assesments a
+        JOIN questions q ON q.q_id = a.q_id
+        ORDER BY a.answer_id
+    ''').fetchall()
+    db.close()
+
+    positions = {question: index for index, (question, _) in enumerate(initial_asses_qs)}
+    answers = {}
+    for user_id, question, is_correct in rows:
+        if question in positions and is_correct is not None:
+            answers.setdefault(user_id, {})[positions[question]] = int(is_correct)
+
+    return [[verdicts[index] for index in range(len(initial_asses_qs))]
+            for verdicts in answers.values() if len(verdicts) == len(initial_asses_qs)]
+
+
+def synthetic_verdicts(count: int, rng: random.Random) -> list:
+    """Users of uniformly spread skill, more likely to get lighter questions right."""
+    users = []
+    for _ in range(count):
+        skill = rng.uniform(0, 4)
+        users.append([int(rng.random() < 1 / (1 + math.exp(weight - skill))) for _, weight in initial_asses_qs])
+    return users
+
+
+def replay(assessment: AdaptiveAssessment, verdicts: list, lag: int = 0):
+    """Ask questions until the level is settled. Returns (questions asked, level)."""
+    asked = []
+    while True:
+        known = len(asked) - min(lag, len(asked))
+        results = [(index, verdicts[index]) for index in asked[:known]]
+        pending = asked[known:]
+
+        level = assessment.decided_level(results, pending)
+        index = None if level else assessment.next_question(results, pending)
+        if index is None:
+            break
+        asked.append(index)
+
+    results = [(index, verdicts[index]) for index in asked]
+    return len(asked), assessment.decided_level(results) or level_by_score(assessment.score(results))
+
+
+def main(args):
+    if args.synthetic:
+        users = synthetic_verdicts(args.synthetic, random.Random(args.seed))
+        source = f"{len(users)} synthetic users"
+    else:
+        users = recorded_verdicts(args.db)
+        source = f"{len(users)} users with a complete assessment in {args.db}"
+    if not users:
+        sys.exit(f"No complete assessments in {args.db}; try --synthetic N")
+
+    total = len(initial_asses_qs)
+    full_levels = [level_by_score(sum(weight for (_, weight), verdict in zip(initial_asses_qs, verdicts) if verdict))
+                   for verdicts in users]
+    counts = {level: full_levels.count(level) for level in set(full_levels)}
+
+    print(f"Replaying {source}, lag {args.lag}")
+    print("Levels: " + ", ".join(f"{level} {count}" for level, count in sorted(counts.items())))
+    print(f"{'policy':<12}{'mean':>8}{'p95':>6}{'saved':>9}{'agree':>9}   mean per level")
+    for policy in args.policies:
+        assessment = AdaptiveAssessment(initial_asses_qs, policy=policy, min_questions=args.min_questions)
+        asked, agree, per_level = [], 0, {}
+        for verdicts, full_level in zip(users, full_levels):
+            count, level = replay(assessment, verdicts, args.lag)
+            asked.append(count)
+            agree += level == full_level
+            per_level.setdefault(full_level, []).append(count)
+
+        p95 = sorted(asked)[min(len(asked) - 1, round(0.95 * len(asked)) - 1)]
+        mean = statistics.mean(asked)
+        breakdown = ", ".join(f"{level} {statistics.mean(counts):.1f}" for level, counts in sorted(per_level.items()))
+        print(f"{policy:<12}{mean:>8.2f}{p95:>6}{1 - mean / total:>9.1%}{agree / len(users):>9.1%}   {breakdown}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default=os.getenv('DB_PATH', 'learning_bot.db'), help="Database with recorded assessments")
+    parser.add_argument('--synthetic', type=int, default=0, help="Simulate this many synthetic users instead")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--lag', type=int, default=0, help="Answers still being graded when the next question is chosen")
+    parser.add_argument('--min-questions', type=int, default=0)
+    parser.add_argument('--policies', nargs='+', default=list(POLICIES), choices=POLICIES)
+    main(parser.parse_args())
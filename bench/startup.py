@@ -0,0 +1,112 @@
+"""Startup time of the bot, split into phases, plus its slowest imports.
+
+Each run starts a fresh interpreter and does what main.py does up to the point
+where the bot could take its first update: import, open and seed the database,
+build TelegramBot, then initialize the application against a local fake of
+Telegram. "Cold" runs start from an empty database. "Warm" runs reuse it, as a
+restart or a rolling deploy would.
+
+    python bench/startup.py --runs 5
+
+The import breakdown comes from `python -X importtime` and lists the slowest
+modules imported directly by main.py and tg_bot.
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from fakes import FakeTelegramServer
+
+PHASES = ('imports', 'database', 'bot', 'initialize')
+
+CHILD = '''
+import time
+started = time.perf_counter()
+import asyncio, json
+import main
+marks = [time.perf_counter()]
+
+db = main.DataBaseOps()
+seeded = main.seed_question_bank(db)
+marks.append(time.perf_counter())
+
+from tg_bot import TelegramBot
+bot = TelegramBot(db, started=started)
+marks.append(time.perf_counter())
+
+async def initialize():
+    await bot.application.initialize()
+    await bot.application.post_init(bot.application)
+    marks.append(time.perf_counter()) # not after asyncio.run, which waits for the client warm-up
+asyncio.run(initialize())
+
+times = [end - start for start, end in zip([started] + marks, marks)]
+print(json.dumps({'times': times, 'seeded': seeded}))
+'''
+
+
+def run_once(env: dict) -> dict:
+    output = subprocess.run([sys.executable, '-c', CHILD], cwd=ROOT, env=env,
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def import_breakdown(env: dict, top: int) -> list:
+    """(cumulative µs, module) of the slowest modules imported by main.py and tg_bot themselves."""
+    stderr = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import main, tg_bot'],
+                            cwd=ROOT, env=env, capture_output=True, text=True, check=True).stderr
+    direct = []
+    for line in stderr.splitlines():
+        match = re.match(r'import time:\s+\d+ \|\s+(\d+) \|( *)(\S+)', line)
+        if match and len(match.group(2)) <= 3: # the module itself or a direct import
+            direct.append((int(match.group(1)), match.group(3).strip()))
+    return sorted(direct, reverse=True)[:top]
+
+
+def report(name: str, runs: list) -> None:
+    phases = [statistics.median(run['times'][i] for run in runs) * 1000 for i in range(len(PHASES))]
+    seeded = sum(run['seeded'] for run in runs)
+    print(f"{name:<6}" + "".join(f"{ms:>12.1f}" for ms in phases) + f"{sum(phases):>12.1f}"
+          + f"   seeded {seeded}/{len(runs)}")
+
+
+def main(args):
+    telegram = FakeTelegramServer().start()
+    workdir = tempfile.mkdtemp(prefix='bot-startup-')
+    env = {**os.environ,
+           'DB_PATH': os.path.join(workdir, 'learning_bot.db'),
+           'BOT_TOKEN': '123456:fake',
+           'COHERE_API': 'fake',
+           'TELEGRAM_BASE_URL': telegram.url}
+
+    cold, warm = [], []
+    for _ in range(args.runs):
+        for name in os.listdir(workdir):
+            os.remove(os.path.join(workdir, name))
+        cold.append(run_once(env))
+        warm.append(run_once(env))
+
+    print(f"Median of {args.runs} runs (ms)")
+    print(f"{'':<6}" + "".join(f"{phase:>12}" for phase in PHASES) + f"{'total':>12}")
+    report('cold', cold)
+    report('warm', warm)
+
+    print("\nSlowest imports (cumulative ms)")
+    for micros, module in import_breakdown(env, args.top):
+        print(f"{micros / 1000:>8.1f}  {module}")
+    telegram.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=10, help="Number of imports listed")
+    main(parser.parse_args())
@@ -0,0 +1,520 @@
+import builtins
+import keyword
+import random
+import re
+import time
+import zlib
+from array import array
+from collections import OrderedDict, namedtuple
+from itertools import accumulate
+from datetime import datetime
+from typing import List, Optional, Tuple
+from database import AsyncDataBaseOps
+import metrics
+
+
+class VerdictCache:
+    """Two-tier cache of grading verdicts keyed on (question, normalized answer).
+
+    Answers are often code, where case and indentation matter, so the only
+    normalization is dropping surrounding whitespace and a trailing period.
+
+    The first tier is an in-process LRU with a size cap and a TTL. Misses fall
+    through to the `verdict_cache` SQLite table so that hits survive restarts.
+    """
+
+    def __init__(self, db: AsyncDataBaseOps, max_size: int = 10000, ttl: float = 7 * 24 * 3600):
+        """
+        :param db: Database used as the persistent tier
+        :param max_size: Maximum number of entries kept in memory
+        :param ttl: Lifetime of an entry in seconds
+        """
+        self.db = db
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+        self._entries = OrderedDict() # (question, answer) -> (verdict, created_at)
+        self._by_question = {} # question -> set of answers held in memory
+
+    @staticmethod
+    def normalize(answer: str) -> str:
+        """Strip surrounding whitespace and a trailing period, keeping case and inner whitespace."""
+        answer = answer.strip()
+        return answer[:-1].rstrip() if answer.endswith('.') else answer
+
+    async def get(self, question: str, answer: str) -> Optional[int]:
+        """Return the cached verdict for this answer, or None on a miss."""
+        answer = self.normalize(answer)
+        key = (question, answer)
+        now = time.time()
+
+        entry = self._entries.get(key)
+        if entry is not None:
+            verdict, created_at = entry
+            if now - created_at < self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return verdict
+            self._remove(key)
+
+        row = await self.db.get_cached_verdict(question, answer, now - self.ttl)
+        if row is None:
+            self.misses += 1
+            return None
+
+        verdict, created_at = row
+        self._remember(key, verdict, created_at)
+        self.hits += 1
+        return verdict
+
+    async def put(self, question: str, answer: str, verdict: int) -> None:
+        answer = self.normalize(answer)
+        created_at = time.time()
+
+        self._remember((question, answer), verdict, created_at)
+        await self.db.cache_verdict(question, answer, verdict, created_at)
+
+    async def invalidate(self, question: str) -> None:
+        """Drop every cached verdict for a question from both tiers."""
+        await self.invalidate_many([question])
+
+    async def invalidate_many(self, questions: List[str]) -> None:
+        """Drop every cached verdict for several questions with one database call."""
+        for question in questions:
+            for answer in self._by_question.pop(question, ()):
+                self._entries.pop((question, answer), None)
+
+        await self.db.delete_cached_verdicts(questions=questions)
+
+    async def purge_expired(self) -> None:
+        """Delete expired entries from the persistent tier."""
+        await self.db.delete_cached_verdicts(older_than=time.time() - self.ttl)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'size': len(self._entries),
+        }
+
+    def _remember(self, key, verdict, created_at) -> None:
+        self._entries[key] = (verdict, created_at)
+        self._entries.move_to_end(key)
+        self._by_question.setdefault(key[0], set()).add(key[1])
+
+        while len(self._entries) > self.max_size:
+            oldest, _ = next(iter(self._entries.items()))
+            self._remove(oldest)
+
+    def _remove(self, key) -> None:
+        self._entries.pop(key, None)
+        answers = self._by_question.get(key[0])
+        if answers is not None:
+            answers.discard(key[1])
+            if not answers:
+                del self._by_question[key[0]]
+
+
+class MinHasher:
+    """MinHash signatures of character shingles, with an LSH index over them.
+
+    Two texts' signatures agree in about the same fraction of positions as
+    their shingle sets overlap (Jaccard similarity). Signatures are split into
+    bands, and texts sharing any band land in the same bucket. That way a
+    lookup only compares against likely matches instead of every entry.
+    """
+
+    _PRIME = (1 << 61) - 1
+
+    def __init__(self, num_hashes: int = 64, bands: int = 16, shingle_size: int = 3, seed: int = 1):
+        self.num_hashes = num_hashes
+        self.bands = bands
+        self.rows = num_hashes // bands
+        self.shingle_size = shingle_size
+
+        rng = random.Random(seed) # fixed, so persisted signatures stay comparable
+        self._coefficients = [(rng.randrange(1, self._PRIME), rng.randrange(self._PRIME))
+                              for _ in range(num_hashes)]
+
+    def signature(self, text: str) -> array:
+        k = self.shingle_size
+        shingles = {zlib.crc32(text[i:i + k].encode()) for i in range(max(1, len(text) - k + 1))}
+        return array('Q', (min((a * h + b) % self._PRIME for h in shingles) for a, b in self._coefficients))
+
+    def band_keys(self, signature: array):
+        rows = self.rows
+        return [(band, tuple(signature[band * rows:(band + 1) * rows])) for band in range(self.bands)]
+
+    @staticmethod
+    def similarity(a: array, b: array) -> float:
+        return sum(x == y for x, y in zip(a, b)) / len(a)
+
+
+# words a question can gain or lose without asking something else; questions
+# are about Python anyway, so "in Python" doesn't change them either
+STOPWORDS = frozenset({
+    'a', 'an', 'the', 'is', 'are', 'do', 'does', 'i', 'you', 'we', 'me', 'my', 'can', 'could',
+    'please', 'in', 'of', 'to', 'python',
+})
+
+# words that change the question however similar the rest is: negations and Python's own names
+NEGATIONS = frozenset({'not', 'no', 'never', 'without', 'nor'})
+PYTHON_NAMES = frozenset(keyword.kwlist) | frozenset(name.casefold() for name in dir(builtins))
+
+
+class AnswerCache:
+    """Cache of answers to free-form /ask_cohere questions.
+
+    Questions are keyed on their normalized text. Near-duplicates, which
+    differ in filler words, word order or a typo ("what is the differnce
+    between a list and a tuple?"), are found through MinHash signatures of
+    their words other than STOPWORDS. A near-duplicate is only a hit if both
+    questions also have the same anchors: numbers, operators and other
+    symbols, negations, and Python keywords, builtins or called names. That
+    way "list vs dict" doesn't get the answer to "list vs tuple", nor
+    "print(2 + 3)" the one to "print(2 + 4)". Entries are persisted to the
+    `answer_cache` table and all of them are held in memory, since similarity
+    lookups can't be done in SQL. The cache is bounded by `max_size` (least
+    recently used entries go first) and `ttl`.
+    """
+
+    def __init__(self, db: AsyncDataBaseOps, max_size: int = 5000, ttl: float = 7 * 24 * 3600,
+                 threshold: float = 0.9):
+        """
+        :param db: Database used as the persistent tier
+        :param max_size: Maximum number of entries
+        :param ttl: Lifetime of an entry in seconds
+        :param threshold: Minimum estimated similarity for a near-duplicate hit
+        """
+        self.db = db
+        self.max_size = max_size
+        self.ttl = ttl
+        self.threshold = threshold
+        self.hasher = MinHasher()
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+
+        self._entries = OrderedDict() # normalized question -> (answer, signature, created_at)
+        self._buckets = {} # (band, band values) -> set of normalized questions
+        self._loaded = False
+
+    @staticmethod
+    def normalize(question: str) -> str:
+        """Case-fold, expand "'s" and "n't", drop a closing ?, . or ! and space out words and symbols.
+
+        Operators and other symbols are kept, since "what does == do" and
+        "what does != do" are different questions.
+        """
+        question = re.sub(r"(?<=\w)'s\b", ' is', question.casefold())
+        question = re.sub(r"(?<=\w)n't\b", ' not', question)
+        question = re.sub(r'[?.!\s]+$', '', question)
+        return ' '.join(re.findall(r'\w+|[^\w\s]+', question))
+
+    @staticmethod
+    def content(key: str) -> str:
+        """A normalized question without its STOPWORDS."""
+        return ' '.join(word for word in key.split() if word not in STOPWORDS)
+
+    @staticmethod
+    def anchors(key: str) -> List[str]:
+        """The words of a normalized question that a near-duplicate must share, in order."""
+        words = key.split()
+        return [word for i, word in enumerate(words)
+                if not word.isalpha() # numbers, symbols and identifiers like snake_case or x1
+                or word in NEGATIONS or (word in PYTHON_NAMES and word not in STOPWORDS)
+                or words[i + 1:i + 2] and words[i + 1].startswith('(')] # a called name, e.g. "foo" in "foo()"
+
+    def signature(self, key: str) -> array:
+        # of the words that matter, so filler words don't lower the similarity
+        return self.hasher.signature(self.content(key) or key)
+
+    async def load(self) -> None:
+        """Load unexpired entries from the database, newest last."""
+        rows = await self.db.get_cached_answers(time.time() - self.ttl, self.max_size)
+
+        self._entries.clear()
+        self._buckets = {}
+        for key, answer, signature, created_at in rows:
+            self._remember(key, answer, array('Q', signature), created_at)
+        self._loaded = True
+
+    async def get(self, question: str) -> Optional[str]:
+        """Return a cached answer to this question or a near-duplicate of it, or None."""
+        if not self._loaded:
+            await self.load()
+
+        key = self.normalize(question)
+        if not key:
+            return None
+        now = time.time()
+
+        entry = self._entries.get(key)
+        if entry is not None and now - entry[2] < self.ttl:
+            self._entries.move_to_end(key)
+            self._hit()
+            return entry[0]
+
+        signature = self.signature(key)
+        best, best_similarity = None, self.threshold
+        for candidate in self._candidates(signature):
+            answer, candidate_signature, created_at = self._entries[candidate]
+            if now - created_at >= self.ttl:
+                continue
+            similarity = self.hasher.similarity(signature, candidate_signature)
+            if similarity >= best_similarity and self.anchors(key) == self.anchors(candidate):
+                best, best_similarity = candidate, similarity
+
+        if best is None:
+            self.misses += 1
+            metrics.answer_cache_misses.inc()
+            return None
+
+        self._entries.move_to_end(best)
+        self.near_hits += 1
+        self._hit()
+        return self._entries[best][0]
+
+    async def put(self, question: str, answer: str) -> None:
+        key = self.normalize(question)
+        if not key:
+            return
+        signature = self.signature(key)
+        created_at = time.time()
+
+        self._remember(key, answer, signature, created_at)
+        await self.db.cache_answer(key, answer, signature.tobytes(), created_at)
+
+    async def purge_expired(self) -> None:
+        """Delete expired and evicted entries from the database."""
+        await self.db.delete_cached_answers(time.time() - self.ttl, keep=self.max_size)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'near_hits': self.near_hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'size': len(self._entries),
+        }
+
+    def _hit(self) -> None:
+        self.hits += 1
+        metrics.answer_cache_hits.inc()
+
+    def _candidates(self, signature: array) -> set:
+        candidates = set()
+        for band_key in self.hasher.band_keys(signature):
+            candidates |= self._buckets.get(band_key, set())
+        return candidates
+
+    def _remember(self, key: str, answer: str, signature: array, created_at: float) -> None:
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (answer, signature, created_at)
+        for band_key in self.hasher.band_keys(signature):
+            self._buckets.setdefault(band_key, set()).add(key)
+
+        while len(self._entries) > self.max_size:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: str) -> None:
+        _, signature, _ = self._entries.pop(key)
+        for band_key in self.hasher.band_keys(signature):
+            bucket = self._buckets.get(band_key)
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del self._buckets[band_key]
+
+
+class QuestionPool:
+    """In-memory copy of the question bank grouped by level.
+
+    Loaded from the database on first use and kept in sync by the admin
+    commands, so picking a question is a constant-time random choice rather
+    than a query.
+
+    With a `difficulty_weight` above 0, questions users often get wrong are
+    picked more often: a question is weighted 1 + difficulty_weight * (1 -
+    its recent correct rate). Questions with fewer than `min_attempts`
+    verdicts count as answered correctly half the time. The rates come from
+    question_stats and are reloaded by `refresh_difficulty`.
+    """
+
+    def __init__(self, db: AsyncDataBaseOps, difficulty_weight: float = 0.0, min_attempts: int = 5):
+        self.db = db
+        self.difficulty_weight = difficulty_weight
+        self.min_attempts = min_attempts
+        self._by_level = {} # level -> list of (q_id, question)
+        self._position = {} # q_id -> (level, index into _by_level[level])
+        self._rates = {} # q_id -> recent correct rate
+        self._cum_weights = {} # level -> cumulative weights of _by_level[level], built on demand
+        self._loaded = False
+
+    async def refresh(self) -> None:
+        """Reload the whole bank from the database."""
+        rows = await self.db.get_questions()
+
+        self._by_level = {}
+        self._position = {}
+        for q_id, question, level in rows:
+            self._append(q_id, question, level)
+        if self.difficulty_weight:
+            await self.refresh_difficulty()
+        self._loaded = True
+
+    async def refresh_difficulty(self) -> None:
+        """Reload the correct rates used to weight questions."""
+        self._rates = dict(await self.db.get_question_difficulties(self.min_attempts))
+        self._cum_weights = {}
+
+    async def sample(self, level: str) -> Optional[Tuple[int, str]]:
+        """Pick a random question of the given level.
+
+        Returns:
+            tuple: (q_id, question), or None if the level has no questions.
+        """
+        if not self._loaded:
+            await self.refresh()
+
+        questions = self._by_level.get(level)
+        if not questions:
+            return None
+        if not self.difficulty_weight:
+            return random.choice(questions)
+
+        cum_weights = self._cum_weights.get(level)
+        if cum_weights is None:
+            cum_weights = self._cum_weights[level] = list(accumulate(
+                1 + self.difficulty_weight * (1 - self._rates.get(q_id, 0.5)) for q_id, _ in questions
+            ))
+        return random.choices(questions, cum_weights=cum_weights)[0] # a binary search over cum_weights
+
+    def remove(self, q_id: int) -> None:
+        if q_id not in self._position:
+            return
+
+        level, index = self._position.pop(q_id)
+        self._cum_weights.pop(level, None)
+        questions = self._by_level[level]
+        last = questions.pop()
+        if index < len(questions): # move the last question into the freed slot
+            questions[index] = last
+            self._position[last[0]] = (level, index)
+
+    def _append(self, q_id: int, question: str, level: str) -> None:
+        questions = self._by_level.setdefault(level, [])
+        self._cum_weights.pop(level, None)
+        self._position[q_id] = (level, len(questions))
+        questions.append((q_id, question))
+
+
+UserProfile = namedtuple('UserProfile', ['score', 'level', 'current_question', 'task_interval'])
+
+_MISSING = object()
+
+
+class UserCache:
+    """Bounded write-through cache of user profiles.
+
+    Profiles (score, level, active question, task interval) are kept in an
+    LRU, including the fact that a user doesn't exist. The set of users with
+    an active daily question is held in full, so checking for a pending task
+    never touches the database. Every change to a user must go through the
+    write methods here for the cache to stay correct. When users are sharded
+    across workers, each worker only caches its own shard, whose rows no other
+    worker writes.
+    """
+
+    def __init__(self, db: AsyncDataBaseOps, max_size: int = 50000, shard: Tuple[int, int] = None):
+        self.db = db
+        self.max_size = max_size
+        self.shard = shard
+        self._profiles = OrderedDict() # user_id -> UserProfile, or None for unknown users
+        self._active = set() # user_ids with an active daily question
+
+    async def load(self) -> None:
+        self._profiles.clear()
+        self._active = set(await self.db.get_users_with_active_question(self.shard))
+
+    def has_active_task(self, user_id: int) -> bool:
+        return user_id in self._active
+
+    async def take_active_task(self, user_id: int) -> Optional[UserProfile]:
+        """Claim the user's daily task for grading, so a second answer finds no task.
+
+        The claim is only held in memory: the question stays in the database
+        until record_daily_answer, so the scheduler doesn't see the user as
+        free for a new task while the answer is being graded.
+
+        Returns:
+            UserProfile: The profile holding the question, or None if the user has no active task.
+        """
+        if user_id not in self._active:
+            return None
+        self._active.discard(user_id) # before the first await, so no other answer gets past the check
+
+        profile = await self.get(user_id)
+        return profile if profile is not None and profile.current_question else None
+
+    def restore_active_task(self, user_id: int) -> None:
+        """Give back a task claimed by take_active_task whose answer couldn't be graded."""
+        self._active.add(user_id)
+
+    async def get(self, user_id: int) -> Optional[UserProfile]:
+        """Return the user's profile, or None if they're not subscribed."""
+        profile = self._profiles.get(user_id, _MISSING)
+        if profile is not _MISSING:
+            self._profiles.move_to_end(user_id)
+            return profile
+
+        row = await self.db.get_profile(user_id)
+        profile = UserProfile(*row) if row else None
+        self._store(user_id, profile)
+        return profile
+
+    async def insert_user(self, user_id: int, score: int, name: str, level: str) -> None:
+        task_interval = 24
+        await self.db.insert_user(user_id, score, name, level, task_interval=task_interval)
+        self._store(user_id, UserProfile(score, level, None, task_interval))
+
+    async def delete_user(self, user_id: int) -> None:
+        await self.db.delete_user(user_id)
+        self._store(user_id, None)
+        self._active.discard(user_id)
+
+    async def update_interval(self, user_id: int, interval: int) -> None:
+        await self.db.update_interval(user_id, interval)
+        self._update(user_id, task_interval=interval)
+
+    async def assign_daily_question(self, user_id: int, question: str, assigned_at: datetime) -> None:
+        await self.db.assign_daily_question(user_id, question, assigned_at)
+        self._update(user_id, current_question=question)
+        self._active.add(user_id)
+
+    async def record_daily_answer(self, user_id: int, score: int, level: str, answered_at: datetime) -> None:
+        await self.db.record_daily_answer(user_id, score, level, answered_at)
+        self._update(user_id, score=score, level=level, current_question=None)
+        self._active.discard(user_id)
+
+    async def clear_active_question(self, user_id: int) -> None:
+        await self.db.clear_active_question(user_id)
+        self._update(user_id, current_question=None)
+        self._active.discard(user_id)
+
+    def _update(self, user_id: int, **changes) -> None:
+        profile = self._profiles.get(user_id)
+        if profile is not None: # uncached profiles are read fresh on the next get
+            self._profiles[user_id] = profile._replace(**changes)
+
+    def _store(self, user_id: int, profile: Optional[UserProfile]) -> None:
+        self._profiles[user_id] = profile
+        self._profiles.move_to_end(user_id)
+        while len(self._profiles) > self.max_size:
+            self._profiles.popitem(last=False)
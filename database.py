@@ -1,14 +1,82 @@
+import asyncio
+import functools
+import hashlib
+import json
+import logging
+import os
 import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Tuple
-from datetime import datetime
+from datetime import datetime, timedelta
+from contextlib import contextmanager
+from dotenv import load_dotenv
+from constants import initial_asses_qs
+import metrics
+
+load_dotenv()
+
+DB_PATH = os.getenv('DB_PATH', 'learning_bot.db')
+
+SCHEMA_VERSION = 5
+
+# question levels that are never handed out as daily tasks
+ASSESSMENT_LEVEL = 'assessment'
+RETIRED_LEVEL = 'retired'
+
+# weight of the newest verdict in question_stats.recent_rate; older ones fade out
+# geometrically, so the rate mostly reflects about the last 20 answers
+RECENT_RATE_WEIGHT = 0.1
+
+# next time a user is due for a daily task, derived from the row's own columns
+NEXT_DUE_SQL = "datetime(last_assessment, '+' || task_interval || ' hours')"
+
+PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL', # safe with WAL, only the last transactions can be lost on power failure
+    'cache_size': -64000, # in KiB, i.e. 64 MB
+    'mmap_size': 256 * 1024 * 1024,
+    'temp_store': 'MEMORY',
+    'busy_timeout': 5000, # ms to wait for another writer before failing
+}
+
+_connections = {} # path -> shared sqlite3.Connection
+_connections_lock = threading.Lock()
+
+
+def get_connection(path: str = None) -> sqlite3.Connection:
+    """Return the process-wide connection for a database file, opening and tuning it on first use."""
+    path = path or DB_PATH
+
+    with _connections_lock:
+        if path not in _connections:
+            conn = sqlite3.connect(path, check_same_thread=False)
+            for pragma, value in PRAGMAS.items():
+                conn.execute(f'PRAGMA {pragma} = {value}')
+            _connections[path] = conn
+
+        return _connections[path]
+
 
 class DataBaseOps:
-    def __init__(self) -> None:
-        self.db = sqlite3.connect('learning_bot.db')
-        self.setup_db()
+    def __init__(self, path: str = None, migrate: bool = True) -> None:
+        """
+        :param path: Database file (default: DB_PATH)
+        :param migrate: Bring an older schema up to date right away. Pass False to
+            run `migrate` yourself, e.g. with a smaller chunk size on a large database
+        """
+        self.db = get_connection(path)
+        self.setup_db(migrate)
 
-    def setup_db(self) -> None:
+    def setup_db(self, migrate: bool = True) -> None:
         cursor = self.db.cursor()
+        fresh = not self._columns('users')
+
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+                       version INTEGER NOT NULL)
+        ''')
 
         cursor.execute('''
         CREATE TABLE IF NOT EXISTS users (
@@ -20,7 +88,8 @@ class DataBaseOps:
                        join_time DATETIME,
                        last_assessment DATETIME,
                        task_interval INT,
-                       is_expert BOOLEAN DEFAULT FALSE)        
+                       is_expert BOOLEAN DEFAULT FALSE,
+                       next_due_at DATETIME)
         ''')
 
         cursor.execute('''
@@ -41,17 +110,276 @@ class DataBaseOps:
             CREATE TABLE IF NOT EXISTS assesments (
                 answer_id INTEGER PRIMARY KEY AUTOINCREMENT,
                 user_id INTEGER,
-                question TEXT,
+                q_id INTEGER,
                 user_answer TEXT,
                 is_correct BOOLEAN,
                 timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users(user_id)
+                FOREIGN KEY (user_id) REFERENCES users(user_id),
+                FOREIGN KEY (q_id) REFERENCES questions(q_id)
             )
         ''')
 
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS verdict_cache (
+                question TEXT,
+                answer TEXT,
+                verdict INTEGER,
+                created_at REAL,
+                PRIMARY KEY (question, answer)
+            )
+        ''')
+
+        # answers to /ask_cohere questions, keyed on the normalized question;
+        # signature is the MinHash signature of the question's words other than stopwords, as packed 64-bit ints
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS answer_cache (
+                question TEXT PRIMARY KEY,
+                answer TEXT,
+                signature BLOB,
+                created_at REAL
+            )
+        ''')
+
+        # per-question verdict counts, kept up to date by insert_assesments
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS question_stats (
+                q_id INTEGER PRIMARY KEY,
+                attempts INTEGER NOT NULL,
+                correct INTEGER NOT NULL,
+                recent_rate REAL NOT NULL,
+                FOREIGN KEY (q_id) REFERENCES questions(q_id)
+            )
+        ''')
+
+        # small facts about the database itself, e.g. which question bank was seeded
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS metadata (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            )
+        ''')
+
+        # telegram.ext persistence: user/chat data and conversation states, pickled
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS persisted_data (
+                kind TEXT,
+                key INTEGER,
+                data BLOB,
+                PRIMARY KEY (kind, key)
+            )
+        ''')
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS conversations (
+                name TEXT,
+                key TEXT,
+                state BLOB,
+                PRIMARY KEY (name, key)
+            )
+        ''')
+
+        if fresh:
+            self._set_schema_version(SCHEMA_VERSION)
+        self.db.commit()
+
+        if migrate:
+            self.migrate()
+
+
+    def _create_indexes(self) -> None:
+        cursor = self.db.cursor()
+
+        # the scheduler only ever looks for due users without an active question
+        cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_users_next_due
+        ON users(next_due_at) WHERE current_question IS NULL
+        ''')
+
+        # lets get_top_learners read the first rows of the index instead of sorting the table
+        cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_users_score
+        ON users(score DESC)
+        ''')
+
+        # covers get_questions(q_level=...)
+        cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_questions_level
+        ON questions(q_level, q_id, question)
+        ''')
+
+        # per-user history
+        cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_assesments_user_time
+        ON assesments(user_id, timestamp)
+        ''')
+
+        # per-question stats
+        cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_assesments_question
+        ON assesments(q_id, is_correct)
+        ''')
+
+        # hardest and easiest questions without sorting question_stats
+        cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_question_stats_rate
+        ON question_stats(recent_rate)
+        ''')
+
+        self.db.commit()
+
+
+    def _columns(self, table: str) -> List[str]:
+        return [row[1] for row in self.db.execute(f'PRAGMA table_info({table})')]
+
+
+    def schema_version(self) -> int:
+        row = self.db.execute('SELECT MAX(version) FROM schema_version').fetchone()
+        return row[0] or 0
+
+
+    def _set_schema_version(self, version: int) -> None:
+        self.db.execute('DELETE FROM schema_version')
+        self.db.execute('INSERT INTO schema_version (version) VALUES (?)', (version,))
+
+
+    @contextmanager
+    def _write_transaction(self):
+        """Run a block in one transaction that holds the write lock from the start."""
+        self.db.execute('BEGIN IMMEDIATE')
+        try:
+            yield self.db.cursor()
+        except BaseException:
+            self.db.rollback()
+            raise
         self.db.commit()
 
 
+    def migrate(self, chunk_size: int = 5000) -> int:
+        """
+        Bring the schema up to SCHEMA_VERSION. Safe to run repeatedly and to resume after an interruption.
+        :param chunk_size: Rows copied per transaction when a migration rewrites a table
+        :return: The schema version after migrating
+        """
+        migrations = {
+            1: self._add_next_due_at,
+            2: self._normalize_assesments,
+            3: self.rebuild_question_stats,
+            4: self._clear_verdict_cache,
+            5: self._clear_answer_cache,
+        }
+
+        version = self.schema_version()
+        for target in range(version + 1, SCHEMA_VERSION + 1):
+            logging.info(f"Migrating database schema to version {target}")
+            migrations[target](chunk_size)
+
+            with self._write_transaction():
+                self._set_schema_version(target)
+
+        self._create_indexes()
+        return max(version, SCHEMA_VERSION)
+
+
+    def _add_next_due_at(self, chunk_size: int) -> None:
+        if 'next_due_at' in self._columns('users'):
+            return
+
+        with self._write_transaction() as cursor:
+            cursor.execute('''
+            ALTER TABLE users ADD COLUMN next_due_at DATETIME
+            ''')
+            cursor.execute(f'''
+            UPDATE users SET next_due_at = {NEXT_DUE_SQL}
+            ''')
+
+
+    def _clear_verdict_cache(self, chunk_size: int) -> None:
+        """Drop verdicts cached under the old answer normalization, which ignored case and indentation."""
+        with self._write_transaction() as cursor:
+            cursor.execute('DELETE FROM verdict_cache')
+
+
+    def _clear_answer_cache(self, chunk_size: int) -> None:
+        """Drop answers cached under the old question normalization, which dropped operators."""
+        with self._write_transaction() as cursor:
+            cursor.execute('DELETE FROM answer_cache')
+
+
+    def _normalize_assesments(self, chunk_size: int) -> None:
+        """Replace the question text in assesments with a q_id referencing questions."""
+        if 'question' not in self._columns('assesments'):
+            return
+
+        with self._write_transaction() as cursor:
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS assesments_v2 (
+                    answer_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER,
+                    q_id INTEGER,
+                    user_answer TEXT,
+                    is_correct BOOLEAN,
+                    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (user_id) REFERENCES users(user_id),
+                    FOREIGN KEY (q_id) REFERENCES questions(q_id)
+                )
+            ''')
+
+            # initial assessment questions only live in constants.py, give them ids too
+            cursor.executemany('''
+            INSERT OR IGNORE INTO questions (question, q_level)
+            VALUES (?, ?)
+            ''', [(q, ASSESSMENT_LEVEL) for q, _ in initial_asses_qs])
+
+        # resume after the rows an interrupted run already copied
+        copied = self.db.execute('SELECT COALESCE(MAX(answer_id), 0) FROM assesments_v2').fetchone()[0]
+
+        while True:
+            upper = self.db.execute('''
+            SELECT MAX(answer_id) FROM (
+                SELECT answer_id FROM assesments
+                WHERE answer_id > ?
+                ORDER BY answer_id
+                LIMIT ?)
+            ''', (copied, chunk_size)).fetchone()[0]
+
+            if upper is None:
+                break
+
+            with self._write_transaction():
+                self._copy_assesments(copied, upper)
+
+            logging.info(f"Copied assessments up to id {upper}")
+            copied = upper
+
+        with self._write_transaction() as cursor:
+            # rows written while the chunks were being copied
+            self._copy_assesments(copied, None)
+            cursor.execute('DROP TABLE assesments')
+            cursor.execute('ALTER TABLE assesments_v2 RENAME TO assesments')
+
+
+    def _copy_assesments(self, after_id: int, upto_id: int = None) -> None:
+        bounds = 'answer_id > ?' + (' AND answer_id <= ?' if upto_id is not None else '')
+        params = (after_id, upto_id) if upto_id is not None else (after_id,)
+        cursor = self.db.cursor()
+
+        # questions since deleted from the bank are kept out of rotation
+        cursor.execute(f'''
+        INSERT OR IGNORE INTO questions (question, q_level)
+        SELECT DISTINCT question, '{RETIRED_LEVEL}'
+        FROM assesments
+        WHERE {bounds} AND question IS NOT NULL
+        ''', params)
+
+        cursor.execute(f'''
+        INSERT INTO assesments_v2 (answer_id, user_id, q_id, user_answer, is_correct, timestamp)
+        SELECT a.answer_id, a.user_id, q.q_id, a.user_answer, a.is_correct, a.timestamp
+        FROM assesments a
+        LEFT JOIN questions q ON q.question = a.question
+        WHERE a.{bounds}
+        ''', params)
+
+
     def insert_q(self, questions: List[Tuple[str, str]]) -> None:
         cursor = self.db.cursor()
 
@@ -63,50 +391,145 @@ class DataBaseOps:
         #     except sqlite3.IntegrityError:
         #         print(f"Skipping existing questions: {q}")
 
+        # re-adding an existing question updates its level, which also brings back deleted questions
         with self.db:
-            for q, level in questions:
-                cursor.execute('''
-                INSERT OR IGNORE INTO questions (question, q_level) 
-                VALUES (?, ?)
-                ''', (q, level))
+            cursor.executemany('''
+            INSERT INTO questions (question, q_level)
+            VALUES (?, ?)
+            ON CONFLICT(question) DO UPDATE
+            SET q_level = excluded.q_level
+            ''', questions)
 
-        # for q, level in questions:
-        #     cursor.execute('''
-        #     INSERT INTO questions (question, q_level) 
-        #     VALUES (?, ?)
-        #     ON CONFLICT(question) DO UPDATE
-        #     SET q_level = excluded.q_level
-        #     RETURNING question;
-        #     ''', (q, level))
-        
         # self.db.commit()
 
 
+    def seed_questions(self, questions: List[Tuple[str, str]]) -> bool:
+        """
+        Add the built-in questions with insert_q, unless the same list was added before.
+        The list is recognized by a hash of its content, so a restart doesn't rewrite the bank
+        :param questions: (question, level) pairs, in the order they should be inserted
+        :return: True if the questions were inserted, False if they were already there
+        """
+        digest = hashlib.sha256(json.dumps(questions).encode()).hexdigest()
+        row = self.db.execute("SELECT value FROM metadata WHERE key = 'question_bank'").fetchone()
+        if row and row[0] == digest:
+            return False
+
+        self.insert_q(questions)
+        with self.db:
+            self.db.execute('''
+            INSERT INTO metadata (key, value) VALUES ('question_bank', ?)
+            ON CONFLICT(key) DO UPDATE SET value = excluded.value
+            ''', (digest,))
+        return True
+
+
     def insert_user(self, user_id: int, 
                     score: int, name='no_name', 
                     level='beginner',
                     task_interval=24, 
-                    last_assessment=datetime.now()) -> None:
+                    last_assessment=None) -> None:
         cursor = self.db.cursor()
 
+        last_assessment = last_assessment or datetime.now()
+        next_due_at = last_assessment + timedelta(hours=task_interval)
         is_expert = level.lower() == 'advanced'
         cursor.execute('''
-        INSERT INTO users (user_id, score, name, level, join_time, last_assessment, task_interval, is_expert)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (user_id, score, name, level, datetime.now(), last_assessment, task_interval, is_expert))
+        INSERT INTO users (user_id, score, name, level, join_time, last_assessment, task_interval, is_expert, next_due_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (user_id, score, name, level, datetime.now(), last_assessment, task_interval, is_expert, next_due_at))
 
         self.db.commit()
 
 
     def insert_assesment(self, user_id: int, q: str, ans: str, is_correct, time) -> None:
-        cursor = self.db.cursor()
-        cursor.execute('''
-            INSERT INTO assesments (user_id, question, user_answer, is_correct, timestamp)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (user_id, q, ans, is_correct, time))
+        self.insert_assesments([(user_id, q, ans, is_correct, time)])
 
-        self.db.commit()
 
+    def insert_assesments(self, rows: List[Tuple]) -> None:
+        """
+        Insert many assessment rows in a single transaction, counting their verdicts in question_stats
+        :param rows: Tuples (user_id, question, user_answer, is_correct, timestamp)
+        """
+        with self.db:
+            self.db.executemany('''
+                INSERT INTO assesments (user_id, q_id, user_answer, is_correct, timestamp)
+                VALUES (?, (SELECT q_id FROM questions WHERE question = ?), ?, ?, ?)
+            ''', rows)
+
+            self.db.executemany(f'''
+                INSERT INTO question_stats (q_id, attempts, correct, recent_rate)
+                SELECT q_id, 1, ?1, ?1 FROM questions WHERE question = ?2
+                ON CONFLICT(q_id) DO UPDATE SET
+                    attempts = attempts + 1,
+                    correct = correct + excluded.correct,
+                    recent_rate = recent_rate + {RECENT_RATE_WEIGHT} * (excluded.correct - recent_rate)
+            ''', [(int(bool(is_correct)), q) for _, q, _, is_correct, _ in rows if is_correct is not None])
+
+
+    def rebuild_question_stats(self, chunk_size: int = 5000) -> None:
+        """
+        Recompute question_stats from every recorded verdict, e.g. to fill it in for
+        assessments recorded before it existed. Verdicts are read in chunks, and the
+        table is replaced in one transaction that also takes in verdicts recorded meanwhile
+        """
+        stats = {} # q_id -> [attempts, correct, recent_rate]
+
+        def read_after(answer_id: int, limit: int = -1) -> int:
+            rows = self.db.execute('''
+            SELECT answer_id, q_id, is_correct FROM assesments
+            WHERE answer_id > ? AND q_id IS NOT NULL AND is_correct IS NOT NULL
+            ORDER BY answer_id LIMIT ?
+            ''', (answer_id, limit)).fetchall()
+
+            for _, q_id, is_correct in rows:
+                verdict = int(bool(is_correct))
+                if q_id not in stats:
+                    stats[q_id] = [1, verdict, float(verdict)]
+                    continue
+                entry = stats[q_id]
+                entry[0] += 1
+                entry[1] += verdict
+                entry[2] += RECENT_RATE_WEIGHT * (verdict - entry[2])
+            return rows[-1][0] if rows else answer_id
+
+        last, previous = 0, None
+        while last != previous:
+            previous, last = last, read_after(last, chunk_size)
+
+        with self._write_transaction() as cursor:
+            read_after(last)
+            cursor.execute('DELETE FROM question_stats')
+            cursor.executemany('''
+            INSERT INTO question_stats (q_id, attempts, correct, recent_rate) VALUES (?, ?, ?, ?)
+            ''', [(q_id, *entry) for q_id, entry in stats.items()])
+        logging.info(f"Rebuilt question stats for {len(stats)} questions")
+
+
+    def get_question_stats(self, limit: int, min_attempts: int, hardest: bool = True) -> List[Tuple]:
+        """
+        The questions answered correctly least (or most) often lately
+        :param min_attempts: Leave out questions with fewer verdicts than this
+        :return: Rows of (q_id, question, q_level, attempts, correct, recent_rate)
+        """
+        order = 'ASC' if hardest else 'DESC'
+        return self.db.execute(f'''
+        SELECT s.q_id, q.question, q.q_level, s.attempts, s.correct, s.recent_rate
+        FROM question_stats s
+        JOIN questions q ON q.q_id = s.q_id
+        WHERE s.attempts >= ? AND q.q_level IS NOT ?
+        ORDER BY s.recent_rate {order}
+        LIMIT ?
+        ''', (min_attempts, RETIRED_LEVEL, limit)).fetchall()
+
+
+    def get_question_difficulties(self, min_attempts: int) -> List[Tuple]:
+        """
+        :return: Rows of (q_id, recent_rate) for questions with at least `min_attempts` verdicts
+        """
+        return self.db.execute('''
+        SELECT q_id, recent_rate FROM question_stats WHERE attempts >= ?
+        ''', (min_attempts,)).fetchall()
 
     def delete_user(self, user_id):
         cursor = self.db.cursor()
@@ -118,13 +541,26 @@ class DataBaseOps:
 
     
     def delete_q(self, q_id):
+        """
+        Take a question out of the bank. The row is kept, marked as retired, so
+        assessments that reference it keep their question text
+        :return: The text of the deleted question, or None if no such question exists
+        """
         cursor = self.db.cursor()
-        cursor.execute('''
-        DELETE FROM questions
-        WHERE q_id = ?
-        ''', (q_id,))
 
-        self.db.commit()
+        with self.db:
+            cursor.execute('''
+            SELECT question FROM questions WHERE q_id = ? AND q_level IS NOT ?
+            ''', (q_id, RETIRED_LEVEL))
+            row = cursor.fetchone()
+
+            cursor.execute('''
+            UPDATE questions
+            SET q_level = ?
+            WHERE q_id = ?
+            ''', (RETIRED_LEVEL, q_id))
+
+        return row[0] if row else None
 
 
     def get_questions(self, q_level: str = None) -> List[Tuple]:
@@ -136,11 +572,49 @@ class DataBaseOps:
             ''', (q_level,))
         else:
             cursor.execute('''
-            SELECT * FROM questions
-            ''')
+            SELECT * FROM questions WHERE q_level IS NOT ?
+            ''', (RETIRED_LEVEL,))
             
         questions = cursor.fetchall()
         return questions
+
+
+    def get_questions_page(self, after: int = None, before: int = None, limit: int = 20,
+                           q_level: str = None) -> Tuple[List[Tuple], bool, bool]:
+        """
+        A page of the question bank in q_id order. Pages are found from the q_id at
+        their edge rather than with OFFSET, so a page deep into a large bank is as
+        cheap as the first one
+        :param after: Return the questions following this q_id (default: the first page)
+        :param before: Return the questions preceding this q_id instead
+        :param q_level: Only questions of this level (default: every question not retired)
+        :return: (rows of (q_id, question, q_level), whether earlier questions exist, whether later ones do)
+        """
+        level_filter = 'q_level = ?' if q_level else 'q_level IS NOT ?'
+        level = q_level or RETIRED_LEVEL
+
+        if before is not None:
+            rows = self.db.execute(f'''
+            SELECT q_id, question, q_level FROM questions
+            WHERE {level_filter} AND q_id < ?
+            ORDER BY q_id DESC LIMIT ?
+            ''', (level, before, limit)).fetchall()[::-1]
+        else:
+            rows = self.db.execute(f'''
+            SELECT q_id, question, q_level FROM questions
+            WHERE {level_filter} AND q_id > ?
+            ORDER BY q_id LIMIT ?
+            ''', (level, after or 0, limit)).fetchall()
+
+        if not rows:
+            return rows, False, False
+
+        def exists(condition: str, q_id: int) -> bool:
+            return self.db.execute(f'''
+            SELECT EXISTS(SELECT 1 FROM questions WHERE {level_filter} AND {condition})
+            ''', (level, q_id)).fetchone()[0] == 1
+
+        return rows, exists('q_id < ?', rows[0][0]), exists('q_id > ?', rows[-1][0])
         
     
     def get_users(self, id=None, daily_task=False):
@@ -179,9 +653,108 @@ class DataBaseOps:
         UPDATE users
         SET score = ?,
             current_question = NULL,
-            last_assessment = ?
+            last_assessment = ?,
+            next_due_at = datetime(?, '+' || task_interval || ' hours')
         WHERE user_id = ?
-        ''', (new_score, user_id, assessment_time))
+        ''', (new_score, assessment_time, assessment_time, user_id))
+
+
+    def get_due_users(self, now: datetime, shard: Tuple[int, int] = None) -> List[Tuple]:
+        """
+        Users whose next daily task is due and who have no active question
+        :param shard: (index, count) to only return users with user_id % count == index
+        :return: List of tuples (user_id, level), earliest due first
+        """
+        cursor = self.db.cursor()
+        shard_sql, shard_params = self._shard_filter(shard)
+
+        cursor.execute(f'''
+        SELECT user_id, level
+        FROM users
+        WHERE next_due_at <= ? AND current_question IS NULL {shard_sql}
+        ORDER BY next_due_at
+        ''', (now, *shard_params))
+
+        return cursor.fetchall()
+
+
+    def assign_daily_question(self, user_id: int, question: str, assigned_at: datetime):
+        cursor = self.db.cursor()
+
+        cursor.execute('''
+        UPDATE users
+        SET current_question = ?,
+            last_assessment = ?,
+            next_due_at = datetime(?, '+' || task_interval || ' hours')
+        WHERE user_id = ?
+        ''', (question, assigned_at, assigned_at, user_id))
+
+        self.db.commit()
+
+
+    def record_daily_answer(self, user_id: int, score: int, level: str, answered_at: datetime):
+        """Store the outcome of a daily task and clear the user's active question."""
+        cursor = self.db.cursor()
+
+        is_expert = level == 'advanced'
+        cursor.execute('''
+        UPDATE users
+        SET score = ?,
+            current_question = NULL,
+            last_assessment = ?,
+            next_due_at = datetime(?, '+' || task_interval || ' hours'),
+            level = ?,
+            is_expert = ?
+        WHERE user_id = ?
+        ''', (score, answered_at, answered_at, level, is_expert, user_id))
+
+        self.db.commit()
+
+
+    def get_profile(self, user_id: int):
+        """
+        :return: Tuple (score, level, current_question, task_interval) or None if the user doesn't exist
+        """
+        cursor = self.db.cursor()
+
+        cursor.execute('''
+        SELECT score, level, current_question, task_interval
+        FROM users
+        WHERE user_id = ?
+        ''', (user_id,))
+
+        return cursor.fetchone()
+
+
+    def get_users_with_active_question(self, shard: Tuple[int, int] = None) -> List[int]:
+        cursor = self.db.cursor()
+        shard_sql, shard_params = self._shard_filter(shard)
+
+        cursor.execute(f'''
+        SELECT user_id FROM users WHERE current_question IS NOT NULL {shard_sql}
+        ''', shard_params)
+
+        return [row[0] for row in cursor.fetchall()]
+
+
+    @staticmethod
+    def _shard_filter(shard: Tuple[int, int]) -> Tuple[str, tuple]:
+        if shard is None:
+            return '', ()
+        index, count = shard
+        return 'AND user_id % ? = ?', (count, index)
+
+
+    def clear_active_question(self, user_id: int):
+        cursor = self.db.cursor()
+
+        cursor.execute('''
+        UPDATE users
+        SET current_question = NULL
+        WHERE user_id = ?
+        ''', (user_id,))
+
+        self.db.commit()
 
 
     def execute_query(self, query: str, params: tuple = None):
@@ -199,12 +772,12 @@ class DataBaseOps:
         """
         Retrieve top learners sorted by score in descending order
         :param limit: Maximum number of learners to return (default 10)
-        :return: List of tuples (name, level, score)
+        :return: List of tuples (user_id, name, level, score)
         """
         cursor = self.db.cursor()
 
         cursor.execute('''
-        SELECT name, level, score 
+        SELECT user_id, name, level, score 
         FROM users 
         ORDER BY score DESC 
         LIMIT ?
@@ -218,8 +791,277 @@ class DataBaseOps:
 
         cursor.execute('''
         UPDATE users 
-        SET task_interval = ?
+        SET task_interval = ?,
+            next_due_at = datetime(last_assessment, '+' || ? || ' hours')
         WHERE user_id = ?
-        ''', (interval, user_id))
+        ''', (interval, interval, user_id))
+
+        self.db.commit()
+
+
+    def get_persisted_data(self, kind: str) -> List[Tuple]:
+        """
+        :param kind: 'user', 'chat' or 'bot'
+        :return: List of tuples (key, pickled data)
+        """
+        cursor = self.db.cursor()
+
+        cursor.execute('''
+        SELECT key, data FROM persisted_data WHERE kind = ?
+        ''', (kind,))
+
+        return cursor.fetchall()
+
+
+    def get_conversations(self, name: str) -> List[Tuple]:
+        """
+        :return: List of tuples (JSON-encoded conversation key, pickled state)
+        """
+        cursor = self.db.cursor()
+
+        cursor.execute('''
+        SELECT key, state FROM conversations WHERE name = ?
+        ''', (name,))
+
+        return cursor.fetchall()
+
+
+    def save_persisted(self, data: List[Tuple], conversations: List[Tuple]) -> None:
+        """
+        Write persistence changes in one transaction. A None payload deletes the row
+        :param data: Tuples (kind, key, pickled data or None)
+        :param conversations: Tuples (name, JSON-encoded key, pickled state or None)
+        """
+        with self.db:
+            self.db.executemany('''
+            INSERT OR REPLACE INTO persisted_data (kind, key, data) VALUES (?, ?, ?)
+            ''', [row for row in data if row[2] is not None])
+
+            self.db.executemany('''
+            DELETE FROM persisted_data WHERE kind = ? AND key = ?
+            ''', [row[:2] for row in data if row[2] is None])
+
+            self.db.executemany('''
+            INSERT OR REPLACE INTO conversations (name, key, state) VALUES (?, ?, ?)
+            ''', [row for row in conversations if row[2] is not None])
+
+            self.db.executemany('''
+            DELETE FROM conversations WHERE name = ? AND key = ?
+            ''', [row[:2] for row in conversations if row[2] is None])
+
+
+    def get_cached_verdict(self, question: str, answer: str, min_created_at: float):
+        """
+        Look up a persisted grading verdict
+        :param min_created_at: Entries created before this unix time are treated as expired
+        :return: Tuple (verdict, created_at) or None
+        """
+        cursor = self.db.cursor()
+
+        cursor.execute('''
+        SELECT verdict, created_at
+        FROM verdict_cache
+        WHERE question = ? AND answer = ? AND created_at >= ?
+        ''', (question, answer, min_created_at))
+
+        return cursor.fetchone()
+
+
+    def cache_verdict(self, question: str, answer: str, verdict: int, created_at: float):
+        cursor = self.db.cursor()
+
+        cursor.execute('''
+        INSERT OR REPLACE INTO verdict_cache (question, answer, verdict, created_at)
+        VALUES (?, ?, ?, ?)
+        ''', (question, answer, verdict, created_at))
+
+        self.db.commit()
+
+
+    def delete_cached_verdicts(self, question: str = None, older_than: float = None, questions: List[str] = None):
+        """
+        Remove persisted verdicts for a question (or several) and/or those created before a unix time
+        """
+        cursor = self.db.cursor()
+
+        if question is not None:
+            cursor.execute('''
+            DELETE FROM verdict_cache WHERE question = ?
+            ''', (question,))
+
+        if questions:
+            cursor.executemany('''
+            DELETE FROM verdict_cache WHERE question = ?
+            ''', [(q,) for q in questions])
+
+        if older_than is not None:
+            cursor.execute('''
+            DELETE FROM verdict_cache WHERE created_at < ?
+            ''', (older_than,))
+
+        self.db.commit()
+
+
+    def get_cached_answers(self, min_created_at: float, limit: int) -> List[Tuple]:
+        """
+        :param min_created_at: Entries created before this unix time are treated as expired
+        :return: List of tuples (question, answer, signature, created_at), the newest `limit` entries, oldest first
+        """
+        cursor = self.db.cursor()
+
+        cursor.execute('''
+        SELECT * FROM (
+            SELECT question, answer, signature, created_at
+            FROM answer_cache
+            WHERE created_at >= ?
+            ORDER BY created_at DESC
+            LIMIT ?
+        ) ORDER BY created_at
+        ''', (min_created_at, limit))
+
+        return cursor.fetchall()
+
+
+    def cache_answer(self, question: str, answer: str, signature: bytes, created_at: float):
+        cursor = self.db.cursor()
+
+        cursor.execute('''
+        INSERT OR REPLACE INTO answer_cache (question, answer, signature, created_at)
+        VALUES (?, ?, ?, ?)
+        ''', (question, answer, signature, created_at))
+
+        self.db.commit()
+
+
+    def delete_cached_answers(self, older_than: float, keep: int = None):
+        """
+        Remove cached answers created before a unix time, and all but the newest `keep` entries
+        """
+        cursor = self.db.cursor()
+
+        cursor.execute('''
+        DELETE FROM answer_cache WHERE created_at < ?
+        ''', (older_than,))
+
+        if keep is not None:
+            cursor.execute('''
+            DELETE FROM answer_cache WHERE question NOT IN (
+                SELECT question FROM answer_cache ORDER BY created_at DESC LIMIT ?
+            )
+            ''', (keep,))
+
+        self.db.commit()
+
+
+class AsyncDataBaseOps:
+    """Awaitable version of DataBaseOps.
+
+    Every method of DataBaseOps is available as a coroutine with the same
+    signature. Calls run one at a time on a dedicated I/O thread that owns the
+    shared connection, so disk access never blocks the event loop and writes
+    from different parts of the bot never interleave inside a transaction.
+    """
+
+    def __init__(self, db: DataBaseOps = None) -> None:
+        self.sync = db or DataBaseOps()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db')
+
+    def __getattr__(self, name):
+        method = getattr(self.sync, name)
+        if not callable(method):
+            return method
+
+        @functools.wraps(method)
+        async def call(*args, **kwargs):
+            loop = asyncio.get_running_loop()
+            with metrics.db_latency.time(name):
+                return await loop.run_in_executor(self._executor, functools.partial(method, *args, **kwargs))
+
+        setattr(self, name, call) # skip __getattr__ next time
+        return call
+
+    def close(self) -> None:
+        """Wait for queued queries to finish and stop the I/O thread."""
+        self._executor.shutdown(wait=True)
+
+
+class AssessmentBuffer:
+    """Write-behind buffer for the assesments log.
+
+    Rows are collected in memory and written with one executemany per
+    transaction once `max_rows` rows are waiting or `max_delay` seconds after
+    the first buffered row, whichever comes first. Call `close` on shutdown
+    so nothing buffered is lost.
+    """
+
+    def __init__(self, db: AsyncDataBaseOps, max_rows: int = 100, max_delay: float = 0.5) -> None:
+        """
+        :param db: Database the rows are written to
+        :param max_rows: Number of buffered rows that triggers a flush
+        :param max_delay: Longest time in seconds a row waits before being written
+        """
+        self.db = db
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+
+        self.flushes = 0
+        self.rows_written = 0
+        self.total_flush_time = 0.0
+        self.max_flush_time = 0.0
+
+        self._rows = []
+        self._timer = None
+        self._tasks = set()
+
+    async def add(self, user_id: int, q: str, ans: str, is_correct, timestamp) -> None:
+        self._rows.append((user_id, q, ans, is_correct, timestamp))
+
+        if len(self._rows) >= self.max_rows:
+            await self.flush()
+        elif self._timer is None:
+            loop = asyncio.get_running_loop()
+            self._timer = loop.call_later(self.max_delay, self._flush_later)
+
+    async def flush(self) -> None:
+        """Write every buffered row now."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        rows, self._rows = self._rows, []
+        if not rows:
+            return
+
+        started = time.perf_counter()
+        try:
+            await self.db.insert_assesments(rows)
+        except Exception as e:
+            logging.error(f"Failed to write {len(rows)} assessments, keeping them for the next flush: {str(e)}")
+            self._rows[:0] = rows
+            return
+
+        elapsed = time.perf_counter() - started
+        self.flushes += 1
+        self.rows_written += len(rows)
+        self.total_flush_time += elapsed
+        self.max_flush_time = max(self.max_flush_time, elapsed)
+
+    async def close(self) -> None:
+        if self._tasks:
+            await asyncio.gather(*self._tasks)
+        await self.flush()
+
+    def stats(self) -> dict:
+        return {
+            'flushes': self.flushes,
+            'rows_written': self.rows_written,
+            'pending': len(self._rows),
+            'avg_flush_ms': 1000 * self.total_flush_time / self.flushes if self.flushes else 0.0,
+            'max_flush_ms': 1000 * self.max_flush_time,
+        }
 
-        self.db.commit()
\ No newline at end of file
+    def _flush_later(self) -> None:
+        self._timer = None
+        task = asyncio.create_task(self.flush())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
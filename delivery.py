@@ -0,0 +1,228 @@
+import asyncio
+import logging
+import random
+import time
+from dataclasses import dataclass
+from typing import Iterable, Tuple
+from telegram.constants import MessageLimit
+from telegram.error import Forbidden, BadRequest, NetworkError, RetryAfter
+
+
+class TokenBucket:
+    """Async token bucket allowing `rate` acquisitions per second with bursts up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or 1
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        async with self._lock: # waiters are served in arrival order
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def pause(self, seconds: float) -> None:
+        """Hold back every acquisition for the next `seconds` seconds."""
+        self._tokens = min(self._tokens, 0) - seconds * self.rate
+
+
+@dataclass
+class DeliveryReport:
+    sent: int = 0
+    failed: int = 0
+    retries: int = 0
+    elapsed: float = 0.0
+
+    @property
+    def throughput(self) -> float:
+        """Messages delivered per second."""
+        return self.sent / self.elapsed if self.elapsed else 0.0
+
+
+class MessageDispatcher:
+    """Sends many messages concurrently within Telegram's rate limits.
+
+    A shared token bucket keeps the bot under the global limit (about 30
+    messages per second) and consecutive sends to the same chat are spaced
+    out by `per_chat_interval`. Flood-control errors are retried after the
+    delay Telegram asks for; network errors are retried with jittered
+    exponential backoff.
+    """
+
+    def __init__(self, bot,
+                 global_rate: float = 25,
+                 per_chat_interval: float = 1.0,
+                 concurrency: int = 32,
+                 max_retries: int = 3):
+        """
+        :param bot: The telegram.Bot used to send messages
+        :param global_rate: Maximum messages per second across all chats
+        :param per_chat_interval: Minimum seconds between two messages to the same chat
+        :param concurrency: Maximum number of sends in flight
+        :param max_retries: How many times a failed send is retried
+        """
+        self.bot = bot
+        self.per_chat_interval = per_chat_interval
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.bucket = TokenBucket(global_rate)
+
+        self._last_sent = {} # chat_id -> monotonic time of the last send
+
+    async def send_many(self, messages: Iterable[Tuple[int, str]], **kwargs) -> DeliveryReport:
+        """Send every (chat_id, text) pair and report how it went.
+
+        Extra keyword arguments are passed on to `bot.send_message`.
+        """
+        report = DeliveryReport()
+        queue = asyncio.Queue()
+        for message in messages:
+            queue.put_nowait(message)
+
+        async def worker():
+            while not queue.empty():
+                chat_id, text = queue.get_nowait()
+                await self._send(chat_id, text, report, kwargs)
+
+        started = time.monotonic()
+        workers = min(self.concurrency, queue.qsize())
+        await asyncio.gather(*(worker() for _ in range(workers)))
+        report.elapsed = time.monotonic() - started
+
+        self._forget_idle_chats()
+        return report
+
+    async def _send(self, chat_id: int, text: str, report: DeliveryReport, kwargs: dict) -> None:
+        for attempt in range(self.max_retries + 1):
+            await self._wait_for_chat(chat_id)
+            await self.bucket.acquire()
+            self._last_sent[chat_id] = time.monotonic()
+
+            try:
+                await self.bot.send_message(chat_id=chat_id, text=text, **kwargs)
+                report.sent += 1
+                return
+            except RetryAfter as e: # flood control applies to the whole bot
+                delay = e.retry_after
+                self.bucket.pause(delay)
+            except (Forbidden, BadRequest) as e: # blocked the bot, chat gone, etc.
+                logging.error(f"Failed to send message to user {chat_id}: {str(e)}")
+                break
+            except NetworkError as e:
+                delay = min(30, 2 ** attempt) * (0.5 + random.random())
+                logging.warning(f"Sending to user {chat_id} failed ({str(e)}), retrying in {delay:.1f}s")
+            except Exception as e:
+                logging.error(f"Failed to send message to user {chat_id}: {str(e)}")
+                break
+
+            if attempt < self.max_retries:
+                report.retries += 1
+                await asyncio.sleep(delay)
+        else:
+            logging.error(f"Failed to send message to user {chat_id} after {self.max_retries} retries")
+
+        report.failed += 1
+
+    async def _wait_for_chat(self, chat_id: int) -> None:
+        last = self._last_sent.get(chat_id)
+        if last is not None:
+            wait = last + self.per_chat_interval - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+
+    def _forget_idle_chats(self) -> None:
+        cutoff = time.monotonic() - self.per_chat_interval
+        self._last_sent = {chat: t for chat, t in self._last_sent.items() if t > cutoff}
+
+
+class StreamingReply:
+    """Shows text that arrives in pieces by editing a message as it grows.
+
+    Edits are at least `interval` seconds apart, to stay within Telegram's
+    per-chat edit limits. Text past Telegram's 4096-character limit continues
+    in a new message, split at a line break or space where possible.
+    """
+
+    def __init__(self, message, interval: float = 1.0, max_length: int = MessageLimit.MAX_TEXT_LENGTH):
+        """
+        :param message: The bot's placeholder message, edited to show the text
+        :param interval: Minimum seconds between two edits
+        :param max_length: Longest text a single message may hold
+        """
+        self.message = message
+        self.chat = message.chat
+        self.interval = interval
+        self.max_length = max_length
+        self.edits = 0
+
+        self._text = ''
+        self._start = 0 # where the text of the current message starts
+        self._shown = None
+        self._next_edit = 0.0
+
+    @property
+    def text(self) -> str:
+        return self._text
+
+    async def append(self, chunk: str) -> None:
+        self._text += chunk
+        if time.monotonic() >= self._next_edit:
+            await self._render(final=False)
+
+    async def finish(self) -> None:
+        """Show everything received so far, however recent the last edit was."""
+        await self._render(final=True)
+
+    async def _render(self, final: bool) -> None:
+        while len(self._text) - self._start > self.max_length:
+            end = self._split_point()
+            await self._edit(self._text[self._start:end], final=True) # this message is complete
+            self._start = end
+            while self._start < len(self._text) and self._text[self._start].isspace():
+                self._start += 1
+            self.message, self._shown = None, None # the rest goes in a new message
+
+        await self._edit(self._text[self._start:], final)
+
+    def _split_point(self) -> int:
+        limit = self._start + self.max_length
+        for separator in ('\n', ' '):
+            index = self._text.rfind(separator, self._start + self.max_length // 2, limit)
+            if index != -1:
+                return index
+        return limit
+
+    async def _edit(self, text: str, final: bool) -> None:
+        if not text.strip() or text == self._shown:
+            return
+
+        while True:
+            try:
+                if self.message is None:
+                    self.message = await self.chat.send_message(text)
+                else:
+                    await self.message.edit_text(text)
+                break
+            except RetryAfter as e:
+                if not final: # a later edit will show this text anyway
+                    self._next_edit = time.monotonic() + e.retry_after
+                    return
+                await asyncio.sleep(e.retry_after)
+            except BadRequest as e:
+                if 'not modified' not in str(e).lower():
+                    raise
+                break
+
+        self._shown = text
+        self.edits += 1
+        self._next_edit = time.monotonic() + self.interval
@@ -0,0 +1,68 @@
+from database import AsyncDataBaseOps
+
+
+class Leaderboard:
+    """Top-K learners kept in memory, with the rendered /top_learners table cached.
+
+    Handlers report every score change through `update`. Changes that can't
+    affect the top K cost nothing. Changes inside it reorder the in-memory
+    list. When someone may enter or leave the top K, the list is reloaded
+    from the score index on the next read. The rendered table is only rebuilt
+    when the top K actually changed.
+    """
+
+    def __init__(self, db: AsyncDataBaseOps, k: int = 10):
+        self.db = db
+        self.k = k
+        self._top = [] # [user_id, name, level, score], highest score first
+        self._stale = True
+        self._rendered = None
+
+    async def load(self) -> None:
+        rows = await self.db.get_top_learners(self.k)
+        top = [list(row) for row in rows]
+
+        if top != self._top:
+            self._top = top
+            self._rendered = None
+        self._stale = False
+
+    def update(self, user_id: int, score: int, level: str) -> None:
+        """Record a user's new score and level."""
+        for entry in self._top:
+            if entry[0] != user_id:
+                continue
+
+            if score < entry[3] and len(self._top) == self.k:
+                self._stale = True # someone outside the top K may now rank higher
+            elif (score, level) != (entry[3], entry[2]):
+                entry[2], entry[3] = level, score
+                self._top.sort(key=lambda e: e[3], reverse=True)
+                self._rendered = None
+            return
+
+        if len(self._top) < self.k or score > self._top[-1][3]:
+            self._stale = True # a newcomer, whose name we only get from the db
+
+    def remove(self, user_id: int) -> None:
+        if any(entry[0] == user_id for entry in self._top):
+            self._stale = True
+
+    async def render(self) -> str:
+        """The leaderboard as a Markdown table."""
+        if self._stale:
+            await self.load()
+
+        if self._rendered is None:
+            table_lines = ["🏆 Top Learners 🏆"]
+            table_lines.append("```")
+            table_lines.append(f"{'Name':<10} {'Level':<12} {'Score':<5}")
+            table_lines.append("-" * 30)
+
+            for _, name, level, score in self._top:
+                table_lines.append(f"{name:<10} {level:<12} {score:<5}")
+
+            table_lines.append("```")
+            self._rendered = "\n".join(table_lines)
+
+        return self._rendered
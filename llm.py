@@ -0,0 +1,229 @@
+"""Resilient calls to the LLM provider.
+
+ResilientChat wraps the Cohere client's chat calls with:
+- a limit on calls in flight
+- retries with jittered exponential backoff on 429s, 5xx responses and network errors
+- a circuit breaker that fails fast while the provider is down
+- hedging: a duplicate request is sent when the first one is slow
+"""
+import asyncio
+import logging
+import random
+import time
+from typing import AsyncIterator, Awaitable, Callable
+import httpx
+import metrics
+
+
+class LLMError(Exception):
+    """Base class for LLM failures the bot reports to users instead of crashing."""
+
+
+class LLMUnavailableError(LLMError):
+    """Raised when a call failed after all retries."""
+
+
+class CircuitOpenError(LLMUnavailableError):
+    """Raised without calling the provider while the circuit breaker is open."""
+
+
+class VerdictParseError(LLMError, ValueError):
+    """Raised when a grading reply doesn't contain a verdict."""
+
+
+class CircuitBreaker:
+    """Opens after `failure_threshold` consecutive failures and rejects calls for `reset_timeout` seconds.
+
+    After that, a single trial call is let through (half-open). Its success
+    closes the circuit and its failure opens it again. A trial that never
+    reports back, e.g. because it was cancelled, is replaced by a new one
+    after another `reset_timeout`.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self._opened_at = None
+        self._trial_started = None
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return 'closed'
+        if time.monotonic() - self._opened_at < self.reset_timeout:
+            return 'open'
+        return 'half-open'
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == 'closed':
+            return True
+        now = time.monotonic()
+        if state == 'half-open' and (self._trial_started is None
+                                     or now - self._trial_started >= self.reset_timeout):
+            self._trial_started = now
+            return True
+        return False
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self._opened_at = None
+        self._trial_started = None
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self._trial_started is not None or self.failures >= self.failure_threshold:
+            if self._opened_at is None:
+                logging.warning(f"LLM circuit breaker opened after {self.failures} failures")
+            self._opened_at = time.monotonic()
+            self._trial_started = None
+
+
+def is_retryable(error: Exception) -> bool:
+    from cohere.core import ApiError # imported by now, the client raising `error` needs it
+
+    if isinstance(error, ApiError):
+        return error.status_code == 429 or (error.status_code or 0) >= 500
+    return isinstance(error, httpx.TransportError)
+
+
+class ResilientChat:
+    """Calls `chat(**request)` and `chat_stream(**request)` with retries, a circuit breaker and hedging."""
+
+    def __init__(self,
+                 chat: Callable[..., Awaitable],
+                 chat_stream: Callable[..., AsyncIterator] = None,
+                 max_concurrency: int = 32,
+                 timeout: float = 30,
+                 max_retries: int = 3,
+                 backoff: float = 0.5,
+                 max_backoff: float = 8,
+                 hedge_after: float = 5,
+                 breaker: CircuitBreaker = None):
+        """
+        :param chat: Coroutine function making one request
+        :param chat_stream: Function returning an async iterator of streamed events
+        :param max_concurrency: Maximum number of requests in flight
+        :param timeout: Default timeout per attempt in seconds
+        :param max_retries: How many times a failed request is retried
+        :param backoff: Base delay before the first retry in seconds, doubled for each retry
+        :param max_backoff: Longest delay between retries in seconds
+        :param hedge_after: Send a duplicate request if the first hasn't answered after this many seconds (0 disables)
+        :param breaker: Circuit breaker shared by all calls (default: a new CircuitBreaker)
+        """
+        self.chat = chat
+        self.chat_stream = chat_stream
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.hedge_after = hedge_after
+        self.breaker = breaker or CircuitBreaker()
+        self.limiter = asyncio.Semaphore(max_concurrency)
+
+    async def __call__(self, kind: str, timeout: float = None, **request):
+        """Make a request, retrying retryable failures.
+
+        The timeout covers each attempt, not the time spent queued for a slot.
+
+        Raises:
+            asyncio.TimeoutError: If an attempt takes longer than the timeout.
+            CircuitOpenError: If the circuit breaker is open.
+            LLMUnavailableError: If the request still fails after all retries.
+        """
+        timeout = timeout or self.timeout
+        for attempt in range(self.max_retries + 1):
+            if not self.breaker.allow():
+                metrics.llm_rejected.inc()
+                raise CircuitOpenError("the LLM provider is failing, not calling it for now")
+
+            try:
+                async with self.limiter:
+                    with metrics.llm_latency.time(kind):
+                        response = await self._hedged(request, timeout)
+            except asyncio.TimeoutError:
+                self.breaker.record_failure()
+                raise
+            except Exception as e:
+                if not is_retryable(e):
+                    self.breaker.record_success() # the provider answered, just not with a result
+                    raise
+                self.breaker.record_failure()
+                if attempt == self.max_retries:
+                    raise LLMUnavailableError(f"{kind} failed after {attempt + 1} attempts: {e}") from e
+
+                delay = min(self.max_backoff, self.backoff * 2 ** attempt) * (0.5 + random.random())
+                logging.warning(f"LLM {kind} call failed ({e}), retrying in {delay:.1f}s")
+                metrics.llm_retries.inc()
+                await asyncio.sleep(delay)
+                continue
+
+            self.breaker.record_success()
+            return response
+
+    async def stream(self, kind: str, timeout: float = None, **request) -> AsyncIterator:
+        """Yield streamed events. Streams aren't retried or hedged, but count towards the circuit breaker.
+
+        The timeout applies to each wait for the next event.
+        """
+        if not self.breaker.allow():
+            metrics.llm_rejected.inc()
+            raise CircuitOpenError("the LLM provider is failing, not calling it for now")
+
+        async with self.limiter:
+            with metrics.llm_latency.time(kind):
+                stream = self.chat_stream(**request)
+                try:
+                    while True:
+                        try:
+                            event = await asyncio.wait_for(anext(stream), timeout or self.timeout)
+                        except StopAsyncIteration:
+                            break
+                        yield event
+                except Exception as e:
+                    if isinstance(e, asyncio.TimeoutError) or is_retryable(e):
+                        self.breaker.record_failure()
+                    raise
+                finally:
+                    await stream.aclose()
+
+        self.breaker.record_success()
+
+    async def _hedged(self, request: dict, timeout: float):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        tasks = [asyncio.ensure_future(self.chat(**request))]
+        try:
+            if 0 < self.hedge_after < timeout:
+                done, _ = await asyncio.wait(tasks, timeout=self.hedge_after)
+                # only hedge with a free slot, never by queueing behind other calls
+                if not done and not self.limiter.locked():
+                    async with self.limiter:
+                        metrics.llm_hedges.inc()
+                        tasks.append(asyncio.ensure_future(self.chat(**request)))
+                        return await self._first_result(tasks, deadline)
+            return await self._first_result(tasks, deadline)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    @staticmethod
+    async def _first_result(tasks: list, deadline: float):
+        """Result of the first task to succeed, or the last error if all of them fail."""
+        loop = asyncio.get_running_loop()
+        pending = set(tasks)
+        while True:
+            done, pending = await asyncio.wait(pending, timeout=deadline - loop.time(),
+                                               return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                raise asyncio.TimeoutError()
+
+            failed = None
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                failed = task
+            if not pending:
+                return failed.result() # raises its exception
@@ -1,18 +1,36 @@
-from tg_bot import TelegramBot
-from database import DataBaseOps
+import time
+started = time.perf_counter() # before the imports, so the startup time logged by the bot includes them
+
+import os
+from database import DataBaseOps, ASSESSMENT_LEVEL
 from constants import (
-                    beginner_questions, 
-                    intermediate_questions, 
-                    advanced_questions, 
+                    initial_asses_qs,
+                    beginner_questions,
+                    intermediate_questions,
+                    advanced_questions,
                     )
 
 
+def seed_question_bank(db: DataBaseOps) -> bool:
+    # assessment questions first, so those also in the bank keep their bank level
+    return db.seed_questions([(q, ASSESSMENT_LEVEL) for q, _ in initial_asses_qs]
+                             + beginner_questions + intermediate_questions + advanced_questions)
+
+
 if __name__ == '__main__':
-    bot = TelegramBot()
-    db = DataBaseOps()
+    shard_count = int(os.getenv('SHARD_COUNT', 1))
+    is_worker = os.getenv('SHARD_INDEX') is not None
 
-    db.insert_q(beginner_questions)
-    db.insert_q(intermediate_questions)
-    db.insert_q(advanced_questions)
+    db = None
+    if not is_worker: # workers use the database the front process prepared
+        db = DataBaseOps()
+        seed_question_bank(db)
 
-    bot.run()
+    # each kind of process imports only what it runs: the front never loads the bot
+    if shard_count > 1 and not is_worker:
+        from sharding import run_front
+        run_front(shard_count)
+    else:
+        from tg_bot import TelegramBot
+        bot = TelegramBot(db, started=started)
+        bot.run()
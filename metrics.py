@@ -0,0 +1,194 @@
+"""Lightweight latency metrics exported in the Prometheus text format.
+
+Metrics are off unless METRICS_ENABLED=1 or METRICS_PORT is set. While
+disabled, `instrument` hands back the original callable and `Histogram.time`
+returns a shared no-op context manager, so instrumented code pays next to
+nothing.
+"""
+import bisect
+import functools
+import logging
+import os
+import threading
+import time
+from contextlib import nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from dotenv import load_dotenv
+
+load_dotenv()
+
+METRICS_PORT = int(os.getenv('METRICS_PORT', 0))
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+enabled = os.getenv('METRICS_ENABLED', '0') == '1' or METRICS_PORT > 0
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+_registry = []
+_NOOP = nullcontext()
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {} # label values -> [per-bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value: float, *labels) -> None:
+        if not enabled:
+            return
+
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def time(self, *labels):
+        """Context manager observing the duration of its block."""
+        if not enabled:
+            return _NOOP
+        return _Timer(self, labels)
+
+    def summary(self) -> dict:
+        """Label values -> (count, mean, approximate p95), in seconds."""
+        result = {}
+        with self._lock:
+            series_items = [(labels, list(series)) for labels, series in self._series.items()]
+
+        for labels, series in series_items:
+            counts, total = series[:-1], series[-1]
+            count = sum(counts)
+            if not count:
+                continue
+
+            # upper bound of the bucket holding the 95th percentile
+            target, seen, p95 = 0.95 * count, 0, float('inf')
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                seen += bucket_count
+                if seen >= target:
+                    p95 = bound
+                    break
+            result[labels] = (count, total / count, p95)
+        return result
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series_items = [(labels, list(series)) for labels, series in self._series.items()]
+
+        for labels, series in sorted(series_items):
+            label_text = ','.join(f'{n}="{v}"' for n, v in zip(self.labelnames, labels))
+            prefix = label_text + ',' if label_text else ''
+
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), series[:-1]):
+                cumulative += bucket_count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{self.name}_bucket{{{prefix}le="{le}"}} {cumulative}')
+
+            suffix = f'{{{label_text}}}' if label_text else ''
+            lines.append(f'{self.name}_sum{suffix} {series[-1]}')
+            lines.append(f'{self.name}_count{suffix} {cumulative}')
+        return lines
+
+
+class Counter:
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self.value = 0
+        _registry.append(self)
+
+    def inc(self, amount: float = 1) -> None:
+        if enabled:
+            self.value += amount
+
+    def render(self) -> list:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter",
+                f"{self.name} {self.value}"]
+
+
+class _Timer:
+    __slots__ = ('histogram', 'labels', 'started')
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, *self.labels)
+        return False
+
+
+handler_latency = Histogram('bot_handler_seconds', "Time spent in Telegram update handlers.", ['handler'])
+llm_latency = Histogram('bot_llm_call_seconds', "Duration of LLM calls.", ['kind'])
+db_latency = Histogram('bot_db_query_seconds', "Duration of database calls, including time queued for the I/O thread.", ['method'])
+scheduler_duration = Histogram('bot_scheduler_run_seconds', "Duration of daily task scheduler runs.")
+scheduler_users = Counter('bot_scheduler_users_total', "Users processed by the daily task scheduler.")
+answer_cache_hits = Counter('bot_answer_cache_hits_total', "/ask_cohere questions answered from the cache.")
+answer_cache_misses = Counter('bot_answer_cache_misses_total', "/ask_cohere questions sent to the LLM.")
+llm_retries = Counter('bot_llm_retries_total', "LLM calls retried after a 429, 5xx or network error.")
+llm_hedges = Counter('bot_llm_hedged_total', "Duplicate LLM requests sent because the first was slow.")
+llm_rejected = Counter('bot_llm_rejected_total', "LLM calls failed fast by the open circuit breaker.")
+pregraded = Counter('bot_pregraded_answers_total', "Answers graded locally without the LLM.")
+
+
+def instrument(callback, histogram: Histogram = handler_latency):
+    """Wrap an async callback so each call is timed under its function name."""
+    if not enabled:
+        return callback
+
+    name = callback.__name__
+
+    @functools.wraps(callback)
+    async def timed(*args, **kwargs):
+        with histogram.time(name):
+            return await callback(*args, **kwargs)
+
+    return timed
+
+
+def render() -> str:
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.rstrip('/') != '/metrics':
+            self.send_error(404)
+            return
+
+        body = render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_http_server(port: int = METRICS_PORT, host: str = METRICS_HOST):
+    """Serve /metrics on a background thread. Does nothing if metrics are disabled or no port is set."""
+    if not enabled or not port:
+        return None
+
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logging.info(f"Serving metrics on http://{host}:{port}/metrics")
+    return server
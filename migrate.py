@@ -0,0 +1,29 @@
+"""Bring the bot's database schema up to date.
+
+Safe to run repeatedly: migrations that already ran are skipped, and an
+interrupted run resumes where it stopped. Large tables are rewritten in
+chunks, one transaction each, so the bot can keep running meanwhile.
+
+    python migrate.py --db learning_bot.db --chunk-size 5000
+"""
+import argparse
+import logging
+from database import DataBaseOps, SCHEMA_VERSION
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Migrate the database schema to the latest version.")
+    parser.add_argument('--db', default=None, help="database file (default: DB_PATH or learning_bot.db)")
+    parser.add_argument('--chunk-size', type=int, default=5000, help="rows copied per transaction")
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s', level=logging.INFO)
+
+    db = DataBaseOps(args.db, migrate=False)
+    before = db.schema_version()
+    after = db.migrate(chunk_size=args.chunk_size)
+
+    if before == after:
+        logging.info(f"Schema is already at version {SCHEMA_VERSION}, nothing to do")
+    else:
+        logging.info(f"Schema migrated from version {before} to {after}")
@@ -0,0 +1,149 @@
+import asyncio
+import json
+import logging
+import pickle
+from typing import Optional, Tuple
+from telegram.ext import BasePersistence, PersistenceInput
+from database import AsyncDataBaseOps
+
+
+class SQLitePersistence(BasePersistence):
+    """Stores conversation states and user/chat data in the bot's SQLite database.
+
+    Each user, chat and conversation key is its own row, so only what changed
+    gets written. Changes are tracked in memory and flushed together in one
+    transaction `flush_interval` seconds after the first one, instead of
+    pickling everything into a single file.
+    """
+
+    def __init__(self, db: AsyncDataBaseOps, update_interval: float = 5, flush_interval: float = 1,
+                 shard: Tuple[int, int] = None):
+        """
+        :param db: Database the data is stored in
+        :param update_interval: How often the application hands changed data to the persistence, in seconds
+        :param flush_interval: How long changes are collected before being written, in seconds
+        :param shard: (index, count) to only load the users and chats with id % count == index
+        """
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, callback_data=False),
+            update_interval=update_interval
+        )
+        self.db = db
+        self.flush_interval = flush_interval
+        self.shard = shard
+
+        self._dirty_data = {} # (kind, key) -> pickled data, or None to delete
+        self._dirty_conversations = {} # (name, JSON key) -> pickled state, or None to delete
+        self._written = {} # (kind, key) -> hash of the last data written, to skip unchanged data
+        self._flush_task = None
+
+    async def get_user_data(self) -> dict:
+        return await self._load('user')
+
+    async def get_chat_data(self) -> dict:
+        return await self._load('chat')
+
+    async def get_bot_data(self) -> dict:
+        return {}
+
+    async def get_callback_data(self) -> Optional[tuple]:
+        return None
+
+    async def get_conversations(self, name: str) -> dict:
+        conversations = {}
+        for key, state in await self.db.get_conversations(name):
+            key = tuple(json.loads(key))
+            if self._owns(key[-1]): # keys end with the user id
+                conversations[key] = pickle.loads(state)
+        return conversations
+
+    async def update_conversation(self, name: str, key: tuple, new_state: Optional[object]) -> None:
+        state = pickle.dumps(new_state) if new_state is not None else None
+        self._dirty_conversations[(name, json.dumps(key))] = state
+        self._schedule_flush()
+
+    async def update_user_data(self, user_id: int, data: dict) -> None:
+        self._mark('user', user_id, data)
+
+    async def update_chat_data(self, chat_id: int, data: dict) -> None:
+        self._mark('chat', chat_id, data)
+
+    async def update_bot_data(self, data: dict) -> None:
+        pass
+
+    async def update_callback_data(self, data) -> None:
+        pass
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._mark('user', user_id, None)
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        self._mark('chat', chat_id, None)
+
+    async def refresh_user_data(self, user_id: int, user_data: dict) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: dict) -> None:
+        pass
+
+    async def flush(self) -> None:
+        """Write every pending change now."""
+        task = self._flush_task
+        if task is not None and task is not asyncio.current_task():
+            task.cancel() # called directly, e.g. on shutdown, so the timer isn't needed
+            self._flush_task = None
+
+        data, self._dirty_data = self._dirty_data, {}
+        conversations, self._dirty_conversations = self._dirty_conversations, {}
+        if not data and not conversations:
+            return
+
+        try:
+            await self.db.save_persisted(
+                [(kind, key, payload) for (kind, key), payload in data.items()],
+                [(name, key, state) for (name, key), state in conversations.items()]
+            )
+        except Exception as e:
+            logging.error(f"Failed to persist bot state, retrying with the next flush: {str(e)}")
+            self._dirty_data = {**data, **self._dirty_data}
+            self._dirty_conversations = {**conversations, **self._dirty_conversations}
+            return
+
+        for item, payload in data.items():
+            if payload is None:
+                self._written.pop(item, None)
+            else:
+                self._written[item] = hash(payload)
+
+    async def _load(self, kind: str) -> dict:
+        loaded = {}
+        for key, payload in await self.db.get_persisted_data(kind):
+            if not self._owns(key):
+                continue
+            loaded[key] = pickle.loads(payload)
+            self._written[(kind, key)] = hash(payload)
+        return loaded
+
+    def _owns(self, key: int) -> bool:
+        return self.shard is None or key % self.shard[1] == self.shard[0]
+
+    def _mark(self, kind: str, key: int, data: Optional[dict]) -> None:
+        payload = pickle.dumps(data) if data is not None else None
+        if payload is not None and self._written.get((kind, key)) == hash(payload):
+            self._dirty_data.pop((kind, key), None)
+            return
+
+        self._dirty_data[(kind, key)] = payload
+        self._schedule_flush()
+
+    def _schedule_flush(self) -> None:
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self) -> None:
+        await asyncio.sleep(self.flush_interval)
+        self._flush_task = None # changes from here on schedule the next flush
+        await self.flush()
@@ -0,0 +1,123 @@
+"""Local grading of answers that can be checked without the LLM.
+
+A grader takes (question, answer) and returns 1 or 0 when it's certain, or
+None to leave the answer to the LLM. PreGrader runs its graders in order and
+stops at the first certain verdict.
+"""
+import ast
+import operator
+import re
+from functools import lru_cache
+from typing import Callable, List, Optional, Union
+import metrics
+
+Grader = Callable[[str, str], Optional[int]]
+
+_OPERATORS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv,
+    ast.Mod: operator.mod,
+    ast.Pow: operator.pow,
+    ast.USub: operator.neg,
+    ast.UAdd: operator.pos,
+}
+
+_PRINT_QUESTION = re.compile(r'\boutput of\s+`?print\((.+)\)`?', re.IGNORECASE)
+_NUMBER_ANSWER = re.compile(
+    r'(?:(?:the\s+)?(?:output|answer|result)\s+(?:is|will\s+be|would\s+be)\s*:?|'
+    r'it\s+(?:prints|outputs|will\s+print|would\s+print)|=)?\s*'
+    r'`?(-?\d+(?:\.\d+)?)`?\s*[.!]?',
+    re.IGNORECASE
+)
+
+
+def evaluate_arithmetic(expression: str) -> Union[int, float]:
+    """Evaluate a numeric expression without running any code.
+
+    Only number literals, unary and binary arithmetic operators and
+    parentheses are allowed. Anything else raises ValueError.
+    """
+    def visit(node):
+        if isinstance(node, ast.Expression):
+            return visit(node.body)
+        if isinstance(node, ast.Constant) and type(node.value) in (int, float):
+            return node.value
+        if isinstance(node, ast.UnaryOp) and type(node.op) in _OPERATORS:
+            return _OPERATORS[type(node.op)](visit(node.operand))
+        if isinstance(node, ast.BinOp) and type(node.op) in _OPERATORS:
+            left, right = visit(node.left), visit(node.right)
+            if isinstance(node.op, ast.Pow) and abs(right) > 100:
+                raise ValueError("exponent too large")
+            return _OPERATORS[type(node.op)](left, right)
+        raise ValueError(f"unsupported expression: {ast.dump(node)}")
+
+    try:
+        return visit(ast.parse(expression, mode='eval'))
+    except (SyntaxError, ZeroDivisionError, OverflowError) as e:
+        raise ValueError(str(e))
+
+
+@lru_cache(maxsize=1024)
+def _expected_output(question: str) -> Optional[str]:
+    match = _PRINT_QUESTION.search(question)
+    if match is None:
+        return None
+    try:
+        return str(evaluate_arithmetic(match.group(1)))
+    except ValueError:
+        return None
+
+
+def expected_output(question: str, answer: str) -> Optional[int]:
+    """Grade "What is the output of print(<arithmetic>)" questions by evaluating the expression.
+
+    Only a bare number, optionally phrased as "the output is 14" or "it
+    prints 14", is graded; explanations and working go to the LLM.
+    """
+    expected = _expected_output(question)
+    if expected is None:
+        return None
+
+    match = _NUMBER_ANSWER.fullmatch(answer.strip())
+    if match is None:
+        return None
+
+    given = match.group(1)
+    if given == expected:
+        return 1
+    if float(given) == float(expected): # "5" for 5.0: right value, wrong output
+        return None
+    return 0
+
+
+class PreGrader:
+    """Runs local graders in front of the LLM and counts how often they decide."""
+
+    def __init__(self, graders: List[Grader] = None):
+        self.graders = list(graders) if graders is not None else [expected_output]
+        self.checked = 0
+        self.graded = 0
+
+    def register(self, grader: Grader) -> None:
+        self.graders.append(grader)
+
+    def grade(self, question: str, answer: str) -> Optional[int]:
+        """Return 1 or 0 if some grader is certain, otherwise None."""
+        self.checked += 1
+        for grader in self.graders:
+            verdict = grader(question, answer)
+            if verdict is not None:
+                self.graded += 1
+                metrics.pregraded.inc()
+                return verdict
+        return None
+
+    def stats(self) -> dict:
+        return {
+            'checked': self.checked,
+            'graded_locally': self.graded,
+            'bypass_rate': self.graded / self.checked if self.checked else 0.0,
+        }
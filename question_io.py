@@ -0,0 +1,101 @@
+"""Reading and writing the question bank as CSV or JSONL files.
+
+Files are read one row at a time, so an upload of any size can be imported in
+batches without holding it all in memory.
+
+CSV files have one question per row: `question,level`, optionally under a
+header row naming the columns. Other columns, like the q_id of an export, are
+ignored. JSONL files have one {"question": ..., "level": ...} object per line.
+"""
+import csv
+import json
+import os
+from typing import Collection, Iterable, Iterator, List, Optional, TextIO, Tuple
+
+FORMATS = ('csv', 'jsonl')
+
+
+def format_of(filename: str) -> Optional[str]:
+    """'csv' or 'jsonl' going by the file extension, or None for anything else."""
+    extension = os.path.splitext(filename or '')[1].lower().lstrip('.')
+    return extension if extension in FORMATS else None
+
+
+def read_questions(file: TextIO, fmt: str, levels: Collection[str],
+                   errors: List[Tuple[int, str]]) -> Iterator[Tuple[str, str]]:
+    """Yield (question, level) pairs from a CSV or JSONL file.
+
+    Rows without a question or with a level not in `levels` are skipped and
+    recorded in `errors` as (line number, reason).
+    """
+    rows = _csv_rows(file) if fmt == 'csv' else _jsonl_rows(file, errors)
+    for line, question, level in rows:
+        question = question.strip() if isinstance(question, str) else ''
+        level = level.strip().lower() if isinstance(level, str) else ''
+        if not question:
+            errors.append((line, "no question"))
+        elif level not in levels:
+            errors.append((line, f"unknown level {level!r}"))
+        else:
+            yield question, level
+
+
+def _csv_rows(file: TextIO) -> Iterator[Tuple[int, str, str]]:
+    reader = csv.reader(file)
+    columns = (0, 1)
+    for row in reader:
+        cells = [cell.strip().lower() for cell in row]
+        if reader.line_num == 1 and 'question' in cells and 'level' in cells:
+            columns = (cells.index('question'), cells.index('level'))
+            continue
+        if not any(cells): # blank line
+            continue
+
+        question, level = (row[column] if column < len(row) else None for column in columns)
+        yield reader.line_num, question, level
+
+
+def _jsonl_rows(file: TextIO, errors: List[Tuple[int, str]]) -> Iterator[Tuple[int, str, str]]:
+    for line, text in enumerate(file, start=1):
+        if not text.strip():
+            continue
+        try:
+            item = json.loads(text)
+        except ValueError:
+            item = None
+
+        if isinstance(item, dict):
+            yield line, item.get('question'), item.get('level')
+        else:
+            errors.append((line, "not a JSON object"))
+
+
+def batched(items: Iterable, size: int) -> Iterator[list]:
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class QuestionWriter:
+    """Writes (q_id, question, level) rows in a format read_questions can import again."""
+
+    def __init__(self, file: TextIO, fmt: str):
+        self.file = file
+        self.fmt = fmt
+        self.count = 0
+        if fmt == 'csv':
+            self._csv = csv.writer(file)
+            self._csv.writerow(('q_id', 'question', 'level'))
+
+    def write(self, rows: Iterable[Tuple[int, str, str]]) -> None:
+        for q_id, question, level in rows:
+            if self.fmt == 'csv':
+                self._csv.writerow((q_id, question, level))
+            else:
+                self.file.write(json.dumps({'q_id': q_id, 'question': question, 'level': level}) + '\n')
+            self.count += 1
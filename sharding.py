@@ -0,0 +1,185 @@
+"""Running the bot as several worker processes, each owning a shard of the users.
+
+A user belongs to shard `user_id % SHARD_COUNT`. The front process receives
+Telegram's webhook and forwards each update to the worker owning the user it
+came from, so all of a user's updates, cached profile, conversation state and
+daily tasks live in one worker. Workers share the SQLite database in WAL mode.
+"""
+import asyncio
+import json
+import logging
+import os
+import signal
+import subprocess
+import sys
+from typing import List, Optional
+from urllib.parse import urlparse
+from telegram import Bot, Update
+from tornado.httpclient import AsyncHTTPClient, HTTPClientError, HTTPRequest
+from tornado.httpserver import HTTPServer
+from tornado.web import Application as WebApplication, HTTPError, RequestHandler
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+def shard_of(user_id: int, count: int) -> int:
+    return user_id % count
+
+
+def update_user_id(update: dict) -> Optional[int]:
+    """The id of the user an update came from, found in whichever field the update carries."""
+    for value in update.values():
+        if isinstance(value, dict):
+            user = value.get('from') or value.get('user')
+            if user:
+                return user['id']
+    return None
+
+
+def worker_address(index: int):
+    host = os.getenv('WORKER_HOST', '127.0.0.1')
+    return host, int(os.getenv('WORKER_BASE_PORT', 8600)) + index
+
+
+async def wait_for_signal() -> None:
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    await stop.wait()
+
+
+class _UpdateHandler(RequestHandler):
+    def initialize(self, secret_token: Optional[str], on_update):
+        self.secret_token = secret_token
+        self.on_update = on_update
+
+    async def post(self):
+        if self.secret_token and self.request.headers.get(SECRET_HEADER) != self.secret_token:
+            raise HTTPError(403)
+        try:
+            data = json.loads(self.request.body)
+        except ValueError:
+            raise HTTPError(400)
+
+        self.set_status(await self.on_update(data, self.request.body))
+
+
+class UpdateReceiver:
+    """Worker side: accepts forwarded updates and queues them for the application."""
+
+    def __init__(self, application, host: str, port: int, secret_token: Optional[str] = None):
+        self.application = application
+        self.host = host
+        self.port = port
+        self.secret_token = secret_token
+        self._server = None
+
+    def start(self) -> None:
+        app = WebApplication([(r'/', _UpdateHandler, {'secret_token': self.secret_token,
+                                                       'on_update': self._enqueue})])
+        self._server = HTTPServer(app)
+        self._server.listen(self.port, self.host)
+        logging.info(f"Receiving routed updates on {self.host}:{self.port}")
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.stop()
+            await self._server.close_all_connections()
+
+    async def _enqueue(self, data: dict, body: bytes) -> int:
+        await self.application.update_queue.put(Update.de_json(data, self.application.bot))
+        return 200
+
+
+class UpdateRouter:
+    """Front side: receives Telegram's webhook and forwards each update to its user's worker.
+
+    The worker's status is passed back, so Telegram retries an update a worker
+    failed to take.
+    """
+
+    def __init__(self, worker_urls: List[str], secret_token: Optional[str] = None,
+                 max_connections: int = 100):
+        self.worker_urls = worker_urls
+        self.secret_token = secret_token
+        self.client = AsyncHTTPClient(max_clients=max_connections)
+        self.forwarded = [0] * len(worker_urls)
+
+    async def route(self, data: dict, body: bytes) -> int:
+        user_id = update_user_id(data)
+        index = shard_of(user_id, len(self.worker_urls)) if user_id is not None else 0
+
+        headers = {'Content-Type': 'application/json'}
+        if self.secret_token:
+            headers[SECRET_HEADER] = self.secret_token
+        request = HTTPRequest(self.worker_urls[index], method='POST', body=body,
+                              headers=headers, request_timeout=10)
+        try:
+            await self.client.fetch(request)
+        except HTTPClientError as e:
+            logging.warning(f"Worker {index} rejected update {data.get('update_id')}: {e.code}")
+            return e.code
+        except OSError as e:
+            logging.warning(f"Worker {index} is unreachable: {str(e)}")
+            return 503
+
+        self.forwarded[index] += 1
+        return 200
+
+    def listen(self, host: str, port: int, url_path: str) -> HTTPServer:
+        app = WebApplication([(url_path, _UpdateHandler, {'secret_token': self.secret_token,
+                                                          'on_update': self.route})])
+        server = HTTPServer(app)
+        server.listen(port, host)
+        return server
+
+
+def _spawn_workers(count: int) -> List[subprocess.Popen]:
+    workers = []
+    for index in range(count):
+        env = {**os.environ, 'SHARD_INDEX': str(index), 'SHARD_COUNT': str(count)}
+        workers.append(subprocess.Popen([sys.executable, *sys.argv], env=env))
+    return workers
+
+
+async def _serve_front(count: int) -> None:
+    webhook_url = os.getenv('WEBHOOK_URL')
+    if not webhook_url:
+        raise RuntimeError("Running more than one shard requires WEBHOOK_URL")
+
+    secret_token = os.getenv('WEBHOOK_SECRET')
+    max_connections = int(os.getenv('WEBHOOK_MAX_CONNECTIONS', 40))
+    router = UpdateRouter(
+        [f'http://{host}:{port}/' for host, port in map(worker_address, range(count))],
+        secret_token=secret_token,
+        max_connections=max_connections
+    )
+    server = router.listen(
+        os.getenv('WEBHOOK_LISTEN', '0.0.0.0'),
+        int(os.getenv('WEBHOOK_PORT', 8443)),
+        '/' + os.getenv('WEBHOOK_PATH', urlparse(webhook_url).path).lstrip('/')
+    )
+
+    bot = Bot(os.getenv('BOT_TOKEN'), base_url=os.getenv('TELEGRAM_BASE_URL', 'https://api.telegram.org/bot'))
+    async with bot:
+        await bot.set_webhook(webhook_url, secret_token=secret_token, max_connections=max_connections)
+    logging.info(f"Routing updates for {webhook_url} to {count} workers")
+
+    try:
+        await wait_for_signal()
+    finally:
+        server.stop()
+        logging.info(f"Updates forwarded per worker: {router.forwarded}")
+
+
+def run_front(count: int) -> None:
+    """Start `count` worker processes and route updates to them until interrupted."""
+    workers = _spawn_workers(count)
+    try:
+        asyncio.run(_serve_front(count))
+    finally:
+        for worker in workers:
+            worker.terminate()
+        for worker in workers:
+            worker.wait()
@@ -1,61 +1,257 @@
-import cohere
+import json
 import os
+import re
 from datetime import datetime
+from functools import cached_property
+from typing import AsyncIterator
 from dotenv import load_dotenv
-from constants import cohere_sys_msg
-from database import DataBaseOps
+from constants import cohere_sys_msg, cohere_batch_sys_msg
+from database import AsyncDataBaseOps
+from cache import AnswerCache, VerdictCache
+from batching import BatchParseError, GradingBatcher
+from pregrade import PreGrader
+from assessment import AdaptiveAssessment
+from llm import CircuitBreaker, ResilientChat, VerdictParseError
+import metrics
 
 load_dotenv()
+
+COHERE_MODEL = "command-r-plus-08-2024"
+ASK_SYS_MSG = "Your response must be concise and to the point."
+BATCH_VERDICTS = {1: 1, 0: 0, '1': 1, '0': 0}
+
+
 class PythonLearningBot:
-    def __init__(self):
-        self.co = cohere.ClientV2(os.getenv('COHERE_API'))
-        self.db = DataBaseOps()
+    def __init__(self, db: AsyncDataBaseOps = None, max_concurrency: int = None, timeout: float = None):
+        """
+        :param db: Database shared with the rest of the bot (default: a new AsyncDataBaseOps)
+        :param max_concurrency: Maximum number of in-flight LLM calls made through
+            the async API (default: LLM_MAX_CONCURRENCY env var or 32)
+        :param timeout: Per-call timeout in seconds for the async API
+            (default: LLM_TIMEOUT env var or 30)
+        """
+        self.api_key = os.getenv('COHERE_API')
+        self.base_url = os.getenv('COHERE_BASE_URL') # None means Cohere's production API
+        self.db = db or AsyncDataBaseOps()
 
-    def get_response(self, message, user_asks=0):
+        self.max_concurrency = max_concurrency or int(os.getenv('LLM_MAX_CONCURRENCY', 32))
+        self.timeout = timeout or float(os.getenv('LLM_TIMEOUT', 30))
+        self.llm = ResilientChat(
+            lambda **request: self.async_co.chat(**request),
+            lambda **request: self.async_co.chat_stream(**request),
+            max_concurrency=self.max_concurrency,
+            timeout=self.timeout,
+            max_retries=int(os.getenv('LLM_MAX_RETRIES', 3)),
+            hedge_after=float(os.getenv('LLM_HEDGE_AFTER', 5)),
+            breaker=CircuitBreaker(failure_threshold=int(os.getenv('LLM_BREAKER_THRESHOLD', 5)),
+                                   reset_timeout=float(os.getenv('LLM_BREAKER_RESET', 30)))
+        )
+
+        self.verdicts = VerdictCache(self.db,
+                                     max_size=int(os.getenv('VERDICT_CACHE_SIZE', 10000)),
+                                     ttl=float(os.getenv('VERDICT_CACHE_TTL', 7 * 24 * 3600)))
+        self.pregrader = PreGrader()
+        self.answers = AnswerCache(self.db,
+                                   max_size=int(os.getenv('ANSWER_CACHE_SIZE', 5000)),
+                                   ttl=float(os.getenv('ANSWER_CACHE_TTL', 7 * 24 * 3600)),
+                                   threshold=float(os.getenv('ANSWER_CACHE_SIMILARITY', 0.9)))
+        self.batcher = GradingBatcher(self._grade_batch, self._grade_one,
+                                      window=float(os.getenv('GRADING_BATCH_WINDOW_MS', 50)) / 1000,
+                                      max_batch=int(os.getenv('GRADING_BATCH_SIZE', 16)))
+
+    # the clients are created on first use: importing cohere takes longer than the rest of startup
+    @cached_property
+    def co(self):
+        import cohere
+        return cohere.ClientV2(self.api_key, base_url=self.base_url)
+
+    @cached_property
+    def async_co(self):
+        import cohere
+        return cohere.AsyncClientV2(self.api_key, base_url=self.base_url)
+
+    def warm_up(self) -> None:
+        """Create the async client ahead of the first LLM call, e.g. from a background thread."""
+        self.async_co
+
+    @staticmethod
+    def _build_messages(message, user_asks=0):
         if user_asks: # if this is a question from the user
-            answer = self.co.chat(
-                    model="command-r-plus-08-2024",
-                    messages=[
-                            {"role": "system", "content": "Your response must be concise and to the point."},
-                            {
-                                "role": "user",
-                                "content": f"{message}",
-                            }
-                        ],
-                    )
-            return answer.message.content[0].text
-                
-        messages = [
+            return [
+                {"role": "system", "content": ASK_SYS_MSG},
+                {"role": "user", "content": f"{message}"},
+            ]
+
+        return [
             {"role": "system", "content": cohere_sys_msg},
             {"role": "user", "content": message},
-            ]
-        
-        response = self.co.chat(model="command-r-plus-08-2024", messages=messages)
-        status = int(response.message.content[0].text.rstrip('.'))
-
-        return status
-    
-    def initial_assesment(self, questions, user_id): 
-        score = 0       
-        for q, weight in questions:
+        ]
+
+    @staticmethod
+    def _grading_message(question, answer):
+        return f"Question: {question}. User Answer: {answer}"
+
+    @staticmethod
+    def _parse_verdict(text: str) -> int:
+        """Read a verdict from replies like "1.", "**0**" or "Verdict: 1 (correct)".
+
+        Raises:
+            VerdictParseError: If the reply holds no 0/1 verdict.
+        """
+        match = re.search(r'(?<![\w.])([01])(?![\w]|\.\d)', text)
+        if match:
+            return int(match.group(1))
+
+        words = text.casefold()
+        if re.search(r'\b(incorrect|wrong|not correct)\b', words):
+            return 0
+        if re.search(r'\bcorrect\b', words):
+            return 1
+        raise VerdictParseError(f"no verdict in reply: {text[:100]!r}")
+
+    def get_response(self, message, user_asks=0):
+        """Blocking call to the LLM. Prefer `grade`/`ask` from async code."""
+        with metrics.llm_latency.time('ask' if user_asks else 'grade'):
+            response = self.co.chat(model=COHERE_MODEL,
+                                    messages=self._build_messages(message, user_asks))
+        text = response.message.content[0].text
+
+        if user_asks:
+            return text
+
+        return self._parse_verdict(text)
+
+    async def _chat(self, messages, kind: str, timeout: float = None, **kwargs) -> str:
+        """Run one chat completion without blocking the event loop.
+
+        At most `max_concurrency` calls are in flight at once; callers beyond
+        that wait for a free slot. Rate limits and server errors are retried,
+        and slow requests are hedged, see ResilientChat.
+
+        Raises:
+            asyncio.TimeoutError: If the completion takes longer than the timeout.
+            LLMError: If the provider is unavailable.
+        """
+        response = await self.llm(kind, timeout, model=COHERE_MODEL, messages=messages, **kwargs)
+        return response.message.content[0].text
+
+    async def grade(self, question: str, answer: str) -> int:
+        """Grade a user's answer to a question.
+
+        Answers that can be checked locally, such as the output of an
+        arithmetic expression, are graded without the LLM. Verdicts are cached
+        per question and normalized answer, so repeated answers to the same
+        question don't cost another LLM call. Answers arriving together are
+        graded in a single batched request.
+
+        Returns:
+            int: 1 if the answer is correct, 0 otherwise.
+        """
+        verdict = self.pregrader.grade(question, answer)
+        if verdict is not None:
+            return verdict
+
+        verdict = await self.verdicts.get(question, answer)
+        if verdict is not None:
+            return verdict
+
+        verdict = await self.batcher.submit(question, answer)
+
+        await self.verdicts.put(question, answer, verdict)
+        return verdict
+
+    async def _grade_one(self, question: str, answer: str) -> int:
+        message = self._grading_message(question, answer)
+        text = await self._chat(self._build_messages(message), 'grade')
+        return self._parse_verdict(text)
+
+    async def _grade_batch(self, items) -> list:
+        """Grade several (question, answer) pairs with one LLM call.
+
+        Raises:
+            BatchParseError: If the reply doesn't hold exactly one 0/1 verdict per item.
+        """
+        # answers come from different users: as JSON strings they can't fake item
+        # boundaries, and the system message tells the model they're only data
+        listing = json.dumps([{"question": question, "answer": answer} for question, answer in items],
+                             ensure_ascii=False)
+        messages = [
+            {"role": "system", "content": cohere_batch_sys_msg},
+            {"role": "user", "content": listing},
+        ]
+        text = await self._chat(messages, 'grade_batch', response_format={"type": "json_object"})
+
+        text = re.sub(r'^```(?:json)?|```$', '', text.strip()).strip() # tolerate a Markdown code block
+        try:
+            verdicts = json.loads(text)["verdicts"]
+        except (ValueError, TypeError, KeyError) as e:
+            raise BatchParseError(f"malformed reply: {e}") from e
+
+        if not isinstance(verdicts, list) or len(verdicts) != len(items):
+            raise BatchParseError(f"expected {len(items)} verdicts, got {verdicts!r}")
+
+        # accept "1", true and 1.0 as well as 1
+        parsed = [BATCH_VERDICTS.get(v) if isinstance(v, (int, float, str)) else None for v in verdicts]
+        if None in parsed:
+            raise BatchParseError(f"unexpected verdict values: {verdicts}")
+        return parsed
+
+    async def ask(self, question: str, timeout: float = None) -> str:
+        """Answer a free-form question from a user, from the answer cache if it was asked before."""
+        answer = await self.answers.get(question)
+        if answer is None:
+            answer = await self._chat(self._build_messages(question, user_asks=1), 'ask', timeout)
+            await self.answers.put(question, answer)
+        return answer
+
+    async def ask_stream(self, question: str, timeout: float = None) -> AsyncIterator[str]:
+        """Answer a free-form question, yielding the text as it's generated.
+
+        A cached answer to the same or a near-duplicate question is yielded
+        whole. The timeout applies to each wait for the next piece of text, so
+        long answers aren't cut off as long as they keep coming. Only complete
+        answers are cached.
+
+        Raises:
+            asyncio.TimeoutError: If no text arrives within the timeout.
+        """
+        answer = await self.answers.get(question)
+        if answer is not None:
+            yield answer
+            return
+
+        pieces = []
+        async for piece in self._stream(question, timeout):
+            pieces.append(piece)
+            yield piece
+        if pieces:
+            await self.answers.put(question, ''.join(pieces))
+
+    async def _stream(self, question: str, timeout: float = None) -> AsyncIterator[str]:
+        messages = self._build_messages(question, user_asks=1)
+        async for event in self.llm.stream('ask_stream', timeout, model=COHERE_MODEL, messages=messages):
+            if event.type == 'content-delta' and event.delta.message.content.text:
+                yield event.delta.message.content.text
+
+    def initial_assesment(self, questions, user_id):
+        assessment = AdaptiveAssessment.from_env(questions)
+        results = []
+        index = assessment.next_question(results)
+        while index is not None:
+            q, _ = questions[index]
             ans = input(f'{q} ')
-            message = f"Question: {q}. User Answer: {ans}"
+            message = self._grading_message(q, ans)
             status = self.get_response(message)
-            
-            if status == 1:
-                score += weight
-            
-            self.db.insert_assesment(user_id, q, ans, status, datetime.now())
-
-        if score <= 4:
-            level = 'beginner'
-        elif score > 4 and score <= 12:
-            level = 'intermediate'
-        else:
-            level = 'advanced'
-        
-        #print(score)
-        return level
-    
+            results.append((index, status))
+
+            self.db.sync.insert_assesment(user_id, q, ans, status, datetime.now())
+
+            if assessment.decided_level(results):
+                break
+            index = assessment.next_question(results)
+
+        #print(assessment.score(results))
+        return assessment.decided_level(results)
+
     def daily_task(self):
         pass
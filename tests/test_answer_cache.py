@@ -0,0 +1,75 @@
+import unittest
+from cache import AnswerCache
+
+
+class FakeDataBase:
+    """Just enough of AsyncDataBaseOps for AnswerCache."""
+
+    async def get_cached_answers(self, min_created_at, limit):
+        return []
+
+    async def cache_answer(self, question, answer, signature, created_at):
+        pass
+
+
+class AnswerCacheTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.cache = AnswerCache(FakeDataBase())
+        await self.cache.load()
+
+    async def test_operators_are_different_questions(self):
+        await self.cache.put("What does == do in Python?", "Compares for equality.")
+
+        self.assertIsNone(await self.cache.get("What does != do in Python?"))
+        self.assertIsNone(await self.cache.get("What does % do in Python?"))
+        self.assertEqual(await self.cache.get("what does == do in python"), "Compares for equality.")
+
+    async def test_different_python_names_are_different_questions(self):
+        await self.cache.put("What is the difference between a list and a tuple?", "Tuples are immutable.")
+
+        self.assertIsNone(await self.cache.get("What is the difference between a list and a dict?"))
+        self.assertIsNone(await self.cache.get("What is the difference between a tuple and a list?"))
+        self.assertEqual(self.cache.near_hits, 0)
+
+    async def test_near_duplicates_differing_in_stopwords(self):
+        await self.cache.put("What's the GIL?", "A lock around the interpreter.")
+
+        self.assertEqual(await self.cache.get("what is the GIL in Python"), "A lock around the interpreter.")
+        self.assertEqual(self.cache.near_hits, 1)
+
+    async def test_near_duplicates_with_a_typo(self):
+        await self.cache.put("What is the difference between a list and a tuple?", "Tuples are immutable.")
+
+        self.assertEqual(await self.cache.get("What is the differnce between a list and a tuple"),
+                         "Tuples are immutable.")
+        self.assertEqual(self.cache.near_hits, 1)
+
+    async def test_dissimilar_questions_miss(self):
+        await self.cache.put("How do I sort a dictionary by value?", "sorted(d.items(), key=lambda kv: kv[1])")
+
+        self.assertIsNone(await self.cache.get("How do I sort a dictionary by key?"))
+
+    async def test_numbers_must_match(self):
+        await self.cache.put("What does print(2 + 3 * 4) output?", "14")
+
+        self.assertIsNone(await self.cache.get("What does print(2 + 3 * 5) output?"))
+
+    async def test_negation_must_match(self):
+        await self.cache.put("Why is my variable not defined?", "It's assigned in another scope.")
+
+        self.assertIsNone(await self.cache.get("Why is my variable defined?"))
+
+    async def test_identifiers_must_match(self):
+        await self.cache.put("What does my_func() return?", "None")
+
+        self.assertIsNone(await self.cache.get("What does other_func() return?"))
+
+    def test_anchors(self):
+        anchors = lambda question: self.cache.anchors(self.cache.normalize(question))
+
+        self.assertEqual(anchors("Is a list faster than a tuple?"), ['list', 'tuple'])
+        self.assertEqual(anchors("Why doesn't parse() work without x_1?"), ['not', 'parse', '()', 'without', 'x_1'])
+        self.assertEqual(anchors("What's a decorator?"), [])
+
+if __name__ == '__main__':
+    unittest.main()
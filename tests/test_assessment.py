@@ -0,0 +1,179 @@
+import asyncio
+import os
+import tempfile
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+import database
+from constants import initial_asses_qs
+from database import DataBaseOps
+from tg_bot import ConvState, TelegramBot
+
+QUESTIONS = [question for question, _ in initial_asses_qs]
+
+
+class FakeApplication:
+    """Just enough of telegram.ext.Application to run grading tasks."""
+
+    def __init__(self):
+        self.tasks = []
+
+    def create_task(self, coroutine, update=None):
+        task = asyncio.create_task(coroutine)
+        self.tasks.append((task, update))
+        return task
+
+
+class PipelinedAssessmentTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(), 'bot.db')
+        with mock.patch.dict(os.environ, {'BOT_TOKEN': '1:x', 'PIPELINED_ASSESSMENT': '1'}):
+            self.bot = TelegramBot(DataBaseOps(self.path))
+        self.bot.teacher.grade = self.grade
+        self.delays = {} # question index -> seconds the grading takes
+        self.failures = {} # question index -> exception raised once when grading it
+        self.graded = []
+        self.replies = []
+
+        self.context = SimpleNamespace(user_data={}, application=FakeApplication())
+        self.update = SimpleNamespace(
+            effective_user=SimpleNamespace(id=7, first_name='Ann'),
+            message=SimpleNamespace(text='', reply_text=self.reply),
+        )
+
+    async def asyncTearDown(self):
+        await self.bot.assessments.close()
+        database._connections.pop(self.path).close()
+
+    async def grade(self, question, answer):
+        index = QUESTIONS.index(question)
+        await asyncio.sleep(self.delays.get(index, 0))
+        if index in self.failures:
+            raise self.failures.pop(index)
+        self.graded.append(index)
+        return int(answer == 'right')
+
+    async def reply(self, text, **kwargs):
+        self.replies.append(text)
+
+    async def answer(self, text='right'):
+        self.update.message.text = text
+        return await self.bot.handle_answer(self.update, self.context)
+
+    async def finish(self):
+        state = None
+        for _ in range(3 * len(QUESTIONS)):
+            state = await self.answer()
+            if state == ConvState.END_ASSESSMENT:
+                return state
+        self.fail(f"assessment didn't finish, last state {state}")
+
+    def verdicts(self):
+        return [reply for reply in self.replies if reply.endswith(('Correct!', 'Wrong.'))]
+
+    async def test_next_question_is_sent_before_the_answer_is_graded(self):
+        self.bot._begin_assessment(self.context)
+        self.delays[self.context.user_data['asked'][0]] = 0.05
+
+        self.assertEqual(await self.answer(), ConvState.QUESTION)
+        self.assertEqual(self.graded, [])
+        self.assertEqual(self.context.user_data['answered'], 1)
+        self.assertEqual(len(self.context.user_data['asked']), 2)
+
+    async def test_gradings_run_as_application_tasks(self):
+        self.bot._begin_assessment(self.context)
+        await self.answer()
+
+        [(task, update)] = self.context.application.tasks
+        self.assertIs(update, self.update) # so PTB persists the progress the grading makes
+        await task
+        self.assertEqual(len(self.context.user_data['results']), 1)
+
+    async def test_verdicts_are_reported_in_question_order(self):
+        self.bot._begin_assessment(self.context)
+        first = self.context.user_data['asked'][0]
+        self.delays[first] = 0.05
+        await self.answer('right')
+        second = self.context.user_data['asked'][1]
+        await self.answer('wrong')
+        await asyncio.gather(*(task for task, _ in self.context.application.tasks))
+
+        self.assertEqual(self.graded, [second, first])
+        self.assertEqual(self.verdicts()[0].split(': ')[-1], 'Correct!')
+        self.assertEqual(self.verdicts()[1].split(': ')[-1], 'Wrong.')
+        self.assertEqual(self.context.user_data['results'], [(first, 1), (second, 0)])
+
+    async def test_assessment_finishes_after_every_grading(self):
+        self.bot._begin_assessment(self.context)
+        self.delays = {index: 0.01 for index in range(len(QUESTIONS))}
+
+        self.assertEqual(await self.finish(), ConvState.END_ASSESSMENT)
+        self.assertTrue(self.replies[-1].startswith("Assessment completed!"))
+        user_data = self.context.user_data
+        self.assertEqual(len(user_data['results']), len(user_data['asked']))
+        self.assertEqual(user_data['score'], sum(initial_asses_qs[index][1] for index, _ in user_data['results']))
+        self.assertNotIn(self.update.effective_user.id, self.bot._grading)
+
+    async def test_ungradable_answer_is_asked_again(self):
+        self.bot._begin_assessment(self.context)
+        first = self.context.user_data['asked'][0]
+        self.failures[first] = asyncio.TimeoutError()
+        await self.answer()
+        await asyncio.gather(*(task for task, _ in self.context.application.tasks))
+
+        self.assertNotIn(first, self.context.user_data['asked'])
+        self.assertEqual(self.context.user_data['answered'], 0)
+        self.assertIn("I'll ask this question again", self.replies[-1])
+
+        self.assertEqual(await self.finish(), ConvState.END_ASSESSMENT)
+        self.assertIn((first, 1), self.context.user_data['results'])
+
+    async def test_unexpected_grading_error_is_asked_again(self):
+        self.bot._begin_assessment(self.context)
+        first = self.context.user_data['asked'][0]
+        self.failures[first] = RuntimeError("boom")
+        with self.assertLogs(level='ERROR'):
+            await self.answer()
+            await asyncio.gather(*(task for task, _ in self.context.application.tasks))
+
+        self.assertNotIn(first, self.context.user_data['asked'])
+        self.assertEqual(await self.finish(), ConvState.END_ASSESSMENT)
+
+    async def test_cancelling_stops_the_gradings(self):
+        self.bot._begin_assessment(self.context)
+        self.delays[self.context.user_data['asked'][0]] = 1
+        await self.answer()
+        await self.bot.cancel_assessment(self.update, self.context)
+        await asyncio.sleep(0)
+
+        [(task, _)] = self.context.application.tasks
+        self.assertTrue(task.cancelled())
+        self.assertEqual(self.graded, [])
+
+    async def test_answers_lost_by_a_restart_are_asked_again(self):
+        # progress persisted while two answers were being graded, the second question being the last one
+        a, b, c = range(3)
+        self.context.user_data.update({'asked': [a, b, c], 'results': [(a, 1)], 'answered': 3, 'score': 1})
+
+        self.assertEqual(await self.answer(), ConvState.QUESTION)
+        self.assertIn("I lost some of your answers", self.replies[0])
+        asked = self.context.user_data['asked']
+        self.assertEqual(asked[0], a)
+        self.assertEqual(len(asked), 2)
+        self.assertEqual(self.context.user_data['answered'], 1)
+        self.assertEqual(self.graded, [])
+
+    async def test_answer_after_a_restart_is_graded_for_the_current_question(self):
+        a, b, c = range(3)
+        self.context.user_data.update({'asked': [a, b, c], 'results': [(a, 1)], 'answered': 2, 'score': 1})
+
+        await self.answer()
+        await asyncio.gather(*(task for task, _ in self.context.application.tasks))
+
+        self.assertEqual(self.graded, [c])
+        self.assertEqual(self.context.user_data['results'], [(a, 1), (c, 1)])
+        self.assertNotIn(b, self.context.user_data['asked'][:2])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,175 @@
+import asyncio
+import unittest
+from unittest import mock
+import httpx
+from cohere.core import ApiError
+from llm import CircuitBreaker, CircuitOpenError, LLMUnavailableError, ResilientChat
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class CircuitBreakerTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        patcher = mock.patch('llm.time.monotonic', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.breaker = CircuitBreaker(failure_threshold=3, reset_timeout=30)
+
+    def open(self):
+        for _ in range(3):
+            self.breaker.record_failure()
+
+    def test_opens_after_consecutive_failures(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, 'closed')
+        self.breaker.record_failure()
+
+        self.assertEqual(self.breaker.state, 'open')
+        self.assertFalse(self.breaker.allow())
+
+    def test_success_resets_the_failure_count(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.breaker.record_success()
+        self.breaker.record_failure()
+
+        self.assertEqual(self.breaker.state, 'closed')
+
+    def test_half_open_lets_a_single_trial_through(self):
+        self.open()
+        self.clock.now += 30
+
+        self.assertEqual(self.breaker.state, 'half-open')
+        self.assertTrue(self.breaker.allow())
+        self.assertFalse(self.breaker.allow())
+
+    def test_successful_trial_closes_the_circuit(self):
+        self.open()
+        self.clock.now += 30
+        self.breaker.allow()
+        self.breaker.record_success()
+
+        self.assertEqual(self.breaker.state, 'closed')
+        self.assertTrue(self.breaker.allow())
+
+    def test_failed_trial_opens_the_circuit_again(self):
+        self.open()
+        self.clock.now += 30
+        self.breaker.allow()
+        self.breaker.record_failure()
+
+        self.assertEqual(self.breaker.state, 'open')
+        self.clock.now += 29
+        self.assertFalse(self.breaker.allow())
+
+    def test_lost_trial_is_replaced(self):
+        self.open()
+        self.clock.now += 30
+        self.breaker.allow() # never reports back
+        self.clock.now += 29
+        self.assertFalse(self.breaker.allow())
+        self.clock.now += 1
+
+        self.assertTrue(self.breaker.allow())
+
+
+def api_error(status_code: int) -> ApiError:
+    return ApiError(status_code=status_code, body=None)
+
+
+class ResilientChatTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.calls = 0
+        self.replies = [] # exceptions to raise or (delay, reply) pairs, one per call
+
+    async def chat(self, **request):
+        self.calls += 1
+        reply = self.replies.pop(0)
+        if isinstance(reply, Exception):
+            raise reply
+        delay, reply = reply
+        await asyncio.sleep(delay)
+        return reply
+
+    def llm(self, **kwargs):
+        return ResilientChat(self.chat, **{'backoff': 0, 'hedge_after': 0, 'timeout': 1, **kwargs})
+
+    async def test_retryable_errors_are_retried(self):
+        self.replies = [api_error(429), httpx.ConnectError("refused"), api_error(503), (0, 'hi')]
+
+        self.assertEqual(await self.llm(max_retries=3)('chat', message='hi'), 'hi')
+        self.assertEqual(self.calls, 4)
+
+    async def test_gives_up_after_max_retries(self):
+        self.replies = [api_error(500)] * 3
+
+        with self.assertRaises(LLMUnavailableError):
+            await self.llm(max_retries=2)('chat')
+        self.assertEqual(self.calls, 3)
+
+    async def test_client_errors_are_not_retried(self):
+        llm = self.llm()
+        self.replies = [api_error(400)]
+
+        with self.assertRaises(ApiError):
+            await llm('chat')
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(llm.breaker.failures, 0)
+
+    async def test_open_circuit_fails_fast(self):
+        llm = self.llm(max_retries=0, breaker=CircuitBreaker(failure_threshold=2))
+        self.replies = [api_error(502), api_error(502)]
+        for _ in range(2):
+            with self.assertRaises(LLMUnavailableError):
+                await llm('chat')
+
+        with self.assertRaises(CircuitOpenError):
+            await llm('chat')
+        self.assertEqual(self.calls, 2)
+
+    async def test_timeout_counts_as_a_failure(self):
+        llm = self.llm(max_retries=0)
+        self.replies = [(1, 'late')]
+
+        with self.assertRaises(asyncio.TimeoutError):
+            await llm('chat', timeout=0.05)
+        self.assertEqual(llm.breaker.failures, 1)
+
+    async def test_slow_request_is_hedged(self):
+        self.replies = [(1, 'slow'), (0, 'fast')]
+
+        reply = await asyncio.wait_for(self.llm(hedge_after=0.05)('chat'), timeout=0.5)
+        self.assertEqual(reply, 'fast')
+        self.assertEqual(self.calls, 2)
+
+    async def test_no_hedge_without_a_free_slot(self):
+        self.replies = [(0.1, 'only')]
+
+        self.assertEqual(await self.llm(hedge_after=0.05, max_concurrency=1)('chat'), 'only')
+        self.assertEqual(self.calls, 1)
+
+    async def test_stream_failures_count_towards_the_breaker(self):
+        async def chat_stream(**request):
+            yield 'first'
+            raise httpx.ReadError("reset")
+
+        llm = ResilientChat(self.chat, chat_stream)
+        events = []
+        with self.assertRaises(httpx.ReadError):
+            async for event in llm.stream('stream'):
+                events.append(event)
+
+        self.assertEqual(events, ['first'])
+        self.assertEqual(llm.breaker.failures, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
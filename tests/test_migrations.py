@@ -0,0 +1,127 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+import database
+from database import ASSESSMENT_LEVEL, RETIRED_LEVEL, SCHEMA_VERSION, DataBaseOps
+from constants import initial_asses_qs
+
+# the schema before versioned migrations, as the first release of the bot created it
+BASELINE_SCHEMA = '''
+CREATE TABLE users (
+    user_id INTEGER PRIMARY KEY,
+    score INTEGER,
+    name TEXT,
+    level TEXT,
+    current_question TEXT,
+    join_time DATETIME,
+    last_assessment DATETIME,
+    task_interval INT,
+    is_expert BOOLEAN DEFAULT FALSE);
+
+CREATE TABLE questions (
+    q_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    question TEXT UNIQUE,
+    q_level TEXT);
+
+CREATE TABLE assesments (
+    answer_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER,
+    question TEXT,
+    user_answer TEXT,
+    is_correct BOOLEAN,
+    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (user_id) REFERENCES users(user_id));
+'''
+
+ASSESSMENT_QUESTION = initial_asses_qs[0][0]
+
+
+class MigrationTest(unittest.TestCase):
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(), 'baseline.db')
+        db = sqlite3.connect(self.path)
+        db.executescript(BASELINE_SCHEMA)
+        db.executemany('INSERT INTO users (user_id, score, name, level, last_assessment, task_interval) '
+                       'VALUES (?, ?, ?, ?, ?, ?)',
+                       [(1, 3, 'Ann', 'beginner', '2026-01-01 10:00:00', 24),
+                        (2, 9, 'Bob', 'intermediate', '2026-01-05 08:30:00', 6)])
+        db.executemany('INSERT INTO questions (question, q_level) VALUES (?, ?)',
+                       [('What is a list?', 'beginner'), ('What is a decorator?', 'advanced')])
+        db.executemany('INSERT INTO assesments (user_id, question, user_answer, is_correct, timestamp) '
+                       'VALUES (?, ?, ?, ?, ?)',
+                       [(1, 'What is a list?', 'a sequence', 1, '2026-01-01 10:00:00'),
+                        (2, 'What is a list?', 'no idea', 0, '2026-01-01 11:00:00'),
+                        (2, 'What is a decorator?', 'a wrapper', 1, '2026-01-01 12:00:00'),
+                        (1, ASSESSMENT_QUESTION, '14', 1, '2026-01-01 13:00:00'),
+                        (2, 'A question deleted since', 'x', 0, '2026-01-01 14:00:00'),
+                        (1, 'What is a list?', 'mutable sequence', 1, '2026-01-02 10:00:00'),
+                        (2, 'What is a decorator?', None, None, '2026-01-02 11:00:00')])
+        db.commit()
+        db.close()
+
+    def tearDown(self):
+        connection = database._connections.pop(self.path, None)
+        if connection is not None:
+            connection.close()
+
+    def migrated(self, chunk_size: int) -> DataBaseOps:
+        db = DataBaseOps(self.path, migrate=False)
+        self.assertEqual(db.schema_version(), 0)
+        self.assertEqual(db.migrate(chunk_size=chunk_size), SCHEMA_VERSION)
+        return db
+
+    def test_assessments_reference_questions_by_id(self):
+        db = self.migrated(chunk_size=2) # several chunks
+
+        self.assertNotIn('question', db._columns('assesments'))
+        rows = db.db.execute('''
+        SELECT a.answer_id, a.user_id, q.question, q.q_level, a.user_answer, a.is_correct, a.timestamp
+        FROM assesments a JOIN questions q ON q.q_id = a.q_id
+        ORDER BY a.answer_id
+        ''').fetchall()
+        self.assertEqual(rows, [
+            (1, 1, 'What is a list?', 'beginner', 'a sequence', 1, '2026-01-01 10:00:00'),
+            (2, 2, 'What is a list?', 'beginner', 'no idea', 0, '2026-01-01 11:00:00'),
+            (3, 2, 'What is a decorator?', 'advanced', 'a wrapper', 1, '2026-01-01 12:00:00'),
+            (4, 1, ASSESSMENT_QUESTION, ASSESSMENT_LEVEL, '14', 1, '2026-01-01 13:00:00'),
+            (5, 2, 'A question deleted since', RETIRED_LEVEL, 'x', 0, '2026-01-01 14:00:00'),
+            (6, 1, 'What is a list?', 'beginner', 'mutable sequence', 1, '2026-01-02 10:00:00'),
+            (7, 2, 'What is a decorator?', 'advanced', None, None, '2026-01-02 11:00:00'),
+        ])
+        # existing questions keep their ids
+        self.assertEqual(db.db.execute("SELECT q_id FROM questions WHERE question = 'What is a list?'").fetchone(), (1,))
+        self.assertEqual(db.db.execute("SELECT q_id FROM questions WHERE question = 'What is a decorator?'").fetchone(), (2,))
+
+    def test_next_due_at_is_filled_in(self):
+        db = self.migrated(chunk_size=5000)
+
+        rows = db.db.execute('SELECT user_id, next_due_at FROM users ORDER BY user_id').fetchall()
+        self.assertEqual(rows, [(1, '2026-01-02 10:00:00'), (2, '2026-01-05 14:30:00')])
+
+    def test_question_stats_are_computed_from_the_recorded_verdicts(self):
+        db = self.migrated(chunk_size=3)
+
+        stats = {q_id: (attempts, correct) for q_id, attempts, correct in
+                 db.db.execute('SELECT q_id, attempts, correct FROM question_stats')}
+        ids = dict(db.db.execute('SELECT question, q_id FROM questions'))
+        self.assertEqual(stats, {
+            ids['What is a list?']: (3, 2),
+            ids['What is a decorator?']: (1, 1), # the ungraded answer isn't counted
+            ids[ASSESSMENT_QUESTION]: (1, 1),
+            ids['A question deleted since']: (1, 0),
+        })
+        rate = db.db.execute('SELECT recent_rate FROM question_stats WHERE q_id = ?',
+                             (ids['What is a list?'],)).fetchone()[0]
+        self.assertAlmostEqual(rate, 0.91) # 1, then 1 + 0.1 * (0 - 1), then 0.9 + 0.1 * (1 - 0.9)
+
+    def test_migrating_again_changes_nothing(self):
+        db = self.migrated(chunk_size=5000)
+        before = db.db.execute('SELECT * FROM assesments').fetchall()
+
+        self.assertEqual(db.migrate(), SCHEMA_VERSION)
+        self.assertEqual(db.db.execute('SELECT * FROM assesments').fetchall(), before)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,15 +1,30 @@
-from database import DataBaseOps
+from database import ASSESSMENT_LEVEL, AsyncDataBaseOps, AssessmentBuffer, DataBaseOps
 from teacher_bot import PythonLearningBot
+from delivery import MessageDispatcher, StreamingReply
+from cache import QuestionPool, UserCache
+from leaderboard import Leaderboard
+from persistence import SQLitePersistence
+from sharding import UpdateReceiver, wait_for_signal, worker_address
+from update_processor import PerUserUpdateProcessor
+from llm import LLMError
+from assessment import AdaptiveAssessment, level_by_score
+from question_io import QuestionWriter, batched, format_of, read_questions
 from constants import initial_asses_qs
 from constants import score_weights
+import metrics
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
 import asyncio
+import io
 import os
-import random
 import logging
+import tempfile
+import textwrap
+import time
+from urllib.parse import urlparse
 from enum import Enum, auto
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.constants import FileSizeLimit
 from telegram.error import BadRequest
 from telegram.ext import (
     filters,
@@ -29,6 +44,16 @@ logging.basicConfig(
 
 load_dotenv()
 
+GRADING_TIMEOUT_MSG = "Sorry, grading your answer is taking too long. Please send it again."
+GRADING_FAILED_MSG = "Sorry, I can't grade answers right now. Please send your answer again in a minute."
+ADMIN_ONLY_MSG = "Sorry, this command is only available for admins."
+
+# callback data of the buttons the assessment conversation handles; other buttons, like
+# the /get_questions pages, are left to their own handlers
+CONVERSATION_BUTTONS = r'^(stay|unsubscribe|start_assessment|decline_assessment)$'
+QUESTIONS_PAGE_SIZE = 20 # 20 questions shortened to 180 characters fit in one message
+IMPORT_LEVELS = (*score_weights, ASSESSMENT_LEVEL)
+
 # START, QUESTION, END_ASSESSMENT, DAILY_TASK  = range(4)
 
 class ConvState(Enum):
@@ -39,11 +64,65 @@ class ConvState(Enum):
 
 
 class TelegramBot:
-    def __init__(self):
+    def __init__(self, db: DataBaseOps = None, started: float = None):
+        """
+        :param db: Database the bot runs on (default: a new DataBaseOps)
+        :param started: time.perf_counter() at process start, to log how long startup took
+        """
+        self.started = started or time.perf_counter()
         self.admins = [5859780703]
-        self.db = DataBaseOps()
-        self.teacher = PythonLearningBot()
-        self.application = Application.builder().token(os.getenv('BOT_TOKEN')).build()
+        # set in worker processes started by the front process, see sharding.py
+        self.shard = None
+        if os.getenv('SHARD_INDEX') is not None:
+            self.shard = (int(os.getenv('SHARD_INDEX')), int(os.getenv('SHARD_COUNT')))
+        # Telegram's send limit and the LLM concurrency apply to the bot as a whole, so workers split them
+        workers = self.shard[1] if self.shard is not None else 1
+
+        self.db = AsyncDataBaseOps(db)
+        self.questions = QuestionPool(self.db,
+                                      difficulty_weight=float(os.getenv('DIFFICULTY_WEIGHT', 0)),
+                                      min_attempts=int(os.getenv('STATS_MIN_ATTEMPTS', 5)))
+        self.users = UserCache(self.db, max_size=int(os.getenv('USER_CACHE_SIZE', 50000)), shard=self.shard)
+        self.leaderboard = Leaderboard(self.db)
+        self.assessments = AssessmentBuffer(
+            self.db,
+            max_rows=int(os.getenv('ASSESSMENT_FLUSH_ROWS', 100)),
+            max_delay=float(os.getenv('ASSESSMENT_FLUSH_MS', 500)) / 1000
+        )
+        self.teacher = PythonLearningBot(
+            db=self.db,
+            max_concurrency=max(1, int(os.getenv('LLM_MAX_CONCURRENCY', 32)) // workers)
+        )
+        builder = (
+            Application.builder()
+            .token(os.getenv('BOT_TOKEN'))
+            .base_url(os.getenv('TELEGRAM_BASE_URL', 'https://api.telegram.org/bot'))
+            # grading awaits the LLM, so let updates from different users overlap, while
+            # each user's updates run one at a time as the conversation handler needs
+            .concurrent_updates(PerUserUpdateProcessor(int(os.getenv('CONCURRENT_UPDATES', 256))))
+            .persistence(SQLitePersistence(
+                self.db,
+                update_interval=float(os.getenv('PERSISTENCE_UPDATE_INTERVAL', 5)),
+                flush_interval=float(os.getenv('PERSISTENCE_FLUSH_INTERVAL', 1)),
+                shard=self.shard
+            ))
+            .post_init(self._post_init)
+            .post_shutdown(self._post_shutdown)
+        )
+        if self.shard is not None:
+            builder = builder.updater(None) # updates are forwarded by the front process
+        self.application = builder.build()
+        
+        self.dispatcher = MessageDispatcher(
+            self.application.bot,
+            global_rate=float(os.getenv('SEND_RATE_LIMIT', 25)) / workers,
+            concurrency=int(os.getenv('SEND_CONCURRENCY', 32))
+        )
+
+        # with pipelining the next assessment question is sent while earlier answers are graded
+        self.assessment = AdaptiveAssessment.from_env(initial_asses_qs)
+        self.pipelined_assessment = os.getenv('PIPELINED_ASSESSMENT', '1') == '1'
+        self._grading = {} # user_id -> grading tasks of the ongoing assessment, in answer order
         
         self._setup_handlers()
         self._setup_jobs()
@@ -51,26 +130,28 @@ class TelegramBot:
 
     def _setup_handlers(self):
         """Configure conversation and command handlers."""
+        timed = metrics.instrument # a no-op unless metrics are enabled
         # Main conversation handler for assessment
         self.assessment_handler = ConversationHandler(
-            entry_points=[CommandHandler("start", self.start_command)],
+            entry_points=[CommandHandler("start", timed(self.start_command))],
             states={
                 ConvState.START: [
-                    CallbackQueryHandler(self.button_handler)
+                    CallbackQueryHandler(timed(self.button_handler), pattern=CONVERSATION_BUTTONS)
                 ],
                 ConvState.QUESTION: [
-                    MessageHandler(filters.TEXT & ~filters.COMMAND, self.handle_answer)
+                    MessageHandler(filters.TEXT & ~filters.COMMAND, timed(self.handle_answer))
                 ],
                 ConvState.END_ASSESSMENT: [
-                    CommandHandler("start", self.start_command),
-                    CallbackQueryHandler(self.button_handler)
+                    CommandHandler("start", timed(self.start_command)),
+                    CallbackQueryHandler(timed(self.button_handler), pattern=CONVERSATION_BUTTONS)
                 ]
             },
             fallbacks=[
-                CommandHandler("cancel", self.cancel_assessment),
-                CommandHandler("start", self.start_command)
+                CommandHandler("cancel", timed(self.cancel_assessment)),
+                CommandHandler("start", timed(self.start_command))
             ],
-            name="assessment_conversation"
+            name="assessment_conversation",
+            persistent=True
         )
         
         self.application.add_handler(self.assessment_handler)
@@ -79,32 +160,83 @@ class TelegramBot:
         self.application.add_handler(
             MessageHandler(
                 filters.TEXT & ~filters.COMMAND,
-                self.handle_daily_answer
+                timed(self.handle_daily_answer)
             ),
             group=1  # Lower priority than conversation handler
         )
         
         self.application.add_handlers(handlers={
             2: [  # Even lower priority
-                CommandHandler("get_questions", self.get_questions),
-                CommandHandler("insert_q", self.insert_q),
-                CommandHandler("delete_q", self.delete_q),
-                CommandHandler("ask_cohere", self.ask_cohere),
-                CommandHandler("my_level", self.my_level),
-                CommandHandler("unsubscribe", self.unsubscribe),
-                CommandHandler("skip", self.skip_daily_task),
-                CommandHandler("top_learners", self.top_learners),
-                CommandHandler("task_interval", self.task_interval)
+                CommandHandler("get_questions", timed(self.get_questions)),
+                CommandHandler("insert_q", timed(self.insert_q)),
+                CommandHandler("delete_q", timed(self.delete_q)),
+                CommandHandler("export_q", timed(self.export_questions)),
+                MessageHandler(filters.Document.ALL & filters.CaptionRegex(r'^/import_q\b'),
+                               timed(self.import_questions)),
+                CallbackQueryHandler(timed(self.questions_page_button), pattern=r'^qpage:'),
+                CommandHandler("ask_cohere", timed(self.ask_cohere)),
+                CommandHandler("my_level", timed(self.my_level)),
+                CommandHandler("unsubscribe", timed(self.unsubscribe)),
+                CommandHandler("skip", timed(self.skip_daily_task)),
+                CommandHandler("top_learners", timed(self.top_learners)),
+                CommandHandler("task_interval", timed(self.task_interval)),
+                CommandHandler("stats", timed(self.stats)),
+                CommandHandler("question_stats", timed(self.question_stats))
             ]
         })
 
 
+    async def _post_init(self, application: Application):
+        port = metrics.METRICS_PORT
+        if port and self.shard is not None:
+            port += self.shard[0] # one endpoint per worker
+        metrics.start_http_server(port)
+        await self.users.load()
+        await self.questions.refresh()
+        await self.teacher.verdicts.purge_expired()
+        await self.teacher.answers.purge_expired()
+        await self.teacher.answers.load()
+
+        # import the Cohere client in the background instead of on the first LLM call
+        asyncio.get_running_loop().run_in_executor(None, self.teacher.warm_up)
+        logging.info(f"Started in {time.perf_counter() - self.started:.2f}s")
+
+
+    async def _post_shutdown(self, application: Application):
+        await self.assessments.close()
+        logging.info(f"Assessment writes: {self.assessments.stats()}")
+        self.db.close()
+
+
     def _setup_jobs(self):
         self.job_queue = self.application.job_queue
         self.job_queue.run_repeating(
             callback=self.send_daily_task,
             interval=timedelta(minutes=1)
         )
+
+        if self.questions.difficulty_weight:
+            self.job_queue.run_repeating(
+                callback=self.refresh_difficulty,
+                interval=float(os.getenv('DIFFICULTY_REFRESH_INTERVAL', 600))
+            )
+
+        if self.shard is not None:
+            self.job_queue.run_repeating(
+                callback=self.sync_shared_state,
+                interval=float(os.getenv('SHARD_SYNC_INTERVAL', 60))
+            )
+
+
+    async def refresh_difficulty(self, context: ContextTypes.DEFAULT_TYPE):
+        """Pick up the latest correct rates for weighting daily task questions."""
+        await self.questions.refresh_difficulty()
+
+
+    async def sync_shared_state(self, context: ContextTypes.DEFAULT_TYPE):
+        """Pick up question bank and leaderboard changes made by the other workers."""
+        await self.questions.refresh()
+        await self.leaderboard.load()
     
 
     @staticmethod
@@ -138,7 +270,7 @@ class TelegramBot:
         Returns:
             str: The skill level ('beginner', 'intermediate', or 'advanced').
         """
-        return 'beginner' if score <= 4 else 'intermediate' if score <= 12 else 'advanced'
+        return level_by_score(score)
 
         
     async def start_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -154,15 +286,18 @@ class TelegramBot:
         # context.user_data['current_question_index'] = 0
         # context.user_data['score'] = 0
 
+        self._cancel_grading(update.effective_user.id)
         context.user_data.update({
-            'current_question_index': 0,
+            'asked': [], # question indices in the order they were sent
+            'results': [], # (question index, verdict) in the order they were graded
+            'answered': 0,
             'score': 0
         })
         
         first_name = update.effective_user.first_name
         user_id = update.effective_user.id
         
-        existing_user: tuple = self.db.get_users(user_id) # returns none if not exists
+        existing_user = await self.users.get(user_id) # returns none if not exists
         if not existing_user: # user not in the db
             return await self._handle_new_user(update, first_name)
     
@@ -174,7 +309,8 @@ class TelegramBot:
             msg = (
                 f"Hello, {first_name}. I see this is the first time you use the bot.\n"
                 f"How about you take an assessment to determine your level? "
-                f"Our assessment has {len(initial_asses_qs)} questions."
+                f"Our assessment has {'up to ' if self.assessment.early_stop else ''}"
+                f"{len(initial_asses_qs)} questions."
             )
             reply_markup = self.create_keyboard(texts=["Yes, let's start!", "No, maybe later"],
                                                 callbacks=["start_assessment", "decline_assessment"])
@@ -189,17 +325,16 @@ class TelegramBot:
 
 
     async def _handle_unsubscribe(self, query, _):
-        self.db.delete_user(query.from_user.id)
+        await self.users.delete_user(query.from_user.id)
+        self.leaderboard.remove(query.from_user.id)
         await query.edit_message_text(text="You have been unsubscribed.")
         return ConversationHandler.END
 
 
     async def _handle_start_assessment(self, query, context):
         await query.edit_message_text(text="Great! Let's begin the assessment.")
-        first_question, _ = initial_asses_qs[0]
-        await query.message.reply_text(first_question)
-        context.user_data['current_question_index'] = 0
-        context.user_data['score'] = 0
+        self._cancel_grading(query.from_user.id)
+        await query.message.reply_text(self._begin_assessment(context))
         return ConvState.QUESTION
 
 
@@ -253,48 +388,161 @@ class TelegramBot:
     async def handle_answer(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         """Processes user answers during the assessment."""
         user_id = update.effective_user.id
-        first_name = update.effective_user.first_name
         user_answer = update.message.text
 
-        current_index = context.user_data.get('current_question_index', 0)
-        current_score = context.user_data.get('score', 0)
-
-        if current_index >= len(initial_asses_qs):
-            await update.message.reply_text("Assessment completed!")
-            return ConvState.END_ASSESSMENT
+        asked = context.user_data.get('asked')
+        if not asked: # progress saved before questions were picked adaptively
+            await update.message.reply_text("Sorry, I lost track of your assessment. Let's start over.")
+            await update.message.reply_text(self._begin_assessment(context))
+            return ConvState.QUESTION
 
-        question, weight = initial_asses_qs[current_index]
-        
-        message = f"Question: {question}. User Answer: {user_answer}"
-        status = self.teacher.get_response(message)
+        answered = context.user_data.get('answered', 0)
+        lost = answered - len(context.user_data['results'])
+        if lost and not self._grading.get(user_id): # the bot stopped without finishing their gradings
+            del asked[answered - lost:answered]
+            answered = context.user_data['answered'] = answered - lost
+            if answered == len(asked):
+                await update.message.reply_text("Sorry, I lost some of your answers, I'll ask those questions again.")
+                return await self._next_assessment_step(update, context)
+
+        if answered == len(asked): # every question was answered, the last ones are being graded
+            await update.message.reply_text("Just a moment, I'm still grading your answers.")
+            return None
+
+        index = asked[-1]
+        if self.pipelined_assessment:
+            return await self._handle_answer_pipelined(update, context, index)
+
+        question, weight = initial_asses_qs[index]
+        try:
+            status = await self.teacher.grade(question, user_answer)
+        except asyncio.TimeoutError:
+            await update.message.reply_text(GRADING_TIMEOUT_MSG)
+            return ConvState.QUESTION
+        except LLMError as e:
+            logging.error(f"Grading failed for user {user_id}: {str(e)}")
+            await update.message.reply_text(GRADING_FAILED_MSG)
+            return ConvState.QUESTION
 
         if status == 1:
             await update.message.reply_text("Correct!")
-            current_score += weight
+            context.user_data['score'] = context.user_data.get('score', 0) + weight
         else:
             await update.message.reply_text("Wrong.")
 
-        self.db.insert_assesment(user_id, question, user_answer, status, datetime.now())
+        await self.assessments.add(user_id, question, user_answer, status, datetime.now())
 
-        current_index += 1
-        
-        context.user_data['current_question_index'] = current_index
-        context.user_data['score'] = current_score
+        context.user_data['results'].append((index, status))
+        context.user_data['answered'] = answered + 1
+        return await self._next_assessment_step(update, context)
 
-        if current_index < len(initial_asses_qs):
-            next_question, _ = initial_asses_qs[current_index]
-            await update.message.reply_text(next_question)
-            return ConvState.QUESTION
-        else:
-            level = self.level_by_score(current_score)
-            self.db.insert_user(user_id, current_score, first_name, level)
 
-            await update.message.reply_text(f"Assessment completed! Your level is: {level}")
-            return ConvState.END_ASSESSMENT
+    def _begin_assessment(self, context: ContextTypes.DEFAULT_TYPE) -> str:
+        """Reset the assessment progress and return the first question."""
+        first = self.assessment.next_question([])
+        context.user_data.update({'asked': [first], 'results': [], 'answered': 0, 'score': 0})
+        return initial_asses_qs[first][0]
+
+
+    async def _next_assessment_step(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+        """Send the next question, or finish the assessment once the level is settled.
+
+        Answers still being graded count as possibly right or wrong, so the
+        assessment only stops early if none of their verdicts could change the level.
+        A question whose answer couldn't be graded is no longer counted as asked,
+        so it's asked again if the level still depends on it.
+        """
+        user_id = update.effective_user.id
+        asked, results = context.user_data['asked'], context.user_data['results']
+        while True:
+            pending = asked[len(results):]
+            if self.assessment.decided_level(results, pending) is None:
+                index = self.assessment.next_question(results, pending)
+                if index is not None:
+                    asked.append(index)
+                    await update.message.reply_text(initial_asses_qs[index][0])
+                    return ConvState.QUESTION
+
+            grading = self._grading.pop(user_id, ())
+            if not grading:
+                break
+            await asyncio.gather(*grading, return_exceptions=True)
+
+        score = context.user_data.get('score', 0)
+        level = self.assessment.decided_level(context.user_data['results']) or self.level_by_score(score)
+        await self.users.insert_user(user_id, score, update.effective_user.first_name, level)
+        self.leaderboard.update(user_id, score, level)
+
+        await update.message.reply_text(f"Assessment completed! Your level is: {level}")
+        return ConvState.END_ASSESSMENT
+
+
+    async def _handle_answer_pipelined(self, update: Update, context: ContextTypes.DEFAULT_TYPE,
+                                       index: int) -> int:
+        """Grade the answer in the background and move straight on to the next question.
+
+        Verdicts are reported in question order as they come in. Once the level
+        is settled, it's announced after every grading has finished.
+        """
+        user_id = update.effective_user.id
+        pending = self._grading.setdefault(user_id, [])
+        previous = pending[-1] if pending else None
+
+        # run by the application, so it's awaited on stop and the progress it makes is persisted
+        pending.append(context.application.create_task(self._grade_assessment_answer(
+            update, context, index, update.message.text, previous
+        ), update=update))
+        context.user_data['answered'] = len(context.user_data['asked'])
+        return await self._next_assessment_step(update, context)
+
+
+    async def _grade_assessment_answer(self, update: Update, context: ContextTypes.DEFAULT_TYPE,
+                                       index: int, user_answer: str, previous: asyncio.Task) -> None:
+        """Grade one answer of a pipelined assessment and report the verdict.
+
+        If the answer can't be graded, the question is taken off `asked`, which
+        keeps `results` lined up with it, and is asked again later.
+        """
+        user_id = update.effective_user.id
+        question, weight = initial_asses_qs[index]
+        # quoted rather than numbered, since questions asked again change the numbering
+        label = f'"{textwrap.shorten(question, 50, placeholder="...")}"'
+        try:
+            status = await self.teacher.grade(question, user_answer)
+        except (asyncio.TimeoutError, LLMError) as e:
+            logging.error(f"Grading failed for user {user_id}: {e!r}")
+            status = None
+        except Exception:
+            logging.exception(f"Grading failed for user {user_id}")
+            status = None
+
+        if previous is not None: # report verdicts in question order
+            await asyncio.wait([previous])
+
+        if status is None:
+            context.user_data['asked'].remove(index)
+            context.user_data['answered'] -= 1
+            await update.message.reply_text(
+                f"{label}: sorry, I couldn't grade your answer. I'll ask this question again."
+            )
+            return
+
+        # the progress is updated before replying, so a failed reply can't lose the verdict
+        context.user_data['results'].append((index, status))
+        if status == 1:
+            context.user_data['score'] = context.user_data.get('score', 0) + weight
+        await self.assessments.add(user_id, question, user_answer, status, datetime.now())
+        await update.message.reply_text(f"{label}: {'Correct!' if status == 1 else 'Wrong.'}")
+
+
+    def _cancel_grading(self, user_id: int) -> None:
+        for task in self._grading.pop(user_id, ()):
+            task.cancel()
 
 
     async def cancel_assessment(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Cancels an ongoing assessment session."""
+        self._cancel_grading(update.effective_user.id)
         await update.message.reply_text("Assessment cancelled.")
         return ConvState.END_ASSESSMENT
         
@@ -303,7 +551,7 @@ class TelegramBot:
         """Inserts a new assessment question (admin only)."""
         user_id = update.effective_user.id
         if user_id not in self.admins:
-            await update.message.reply_text("Sorry, this command is only available for admins.")
+            await update.message.reply_text(ADMIN_ONLY_MSG)
             return
         
         full_text = update.message.text
@@ -312,7 +560,9 @@ class TelegramBot:
         question = ' '.join(question_parts)
         q_qlevel = [(question, level.lower())]
 
-        self.db.insert_q(q_qlevel)
+        await self.db.insert_q(q_qlevel)
+        await self.questions.refresh()
+        await self.teacher.verdicts.invalidate(question)
         await update.message.reply_text(f"Question added: '{question}' with level: {level}")
 
     
@@ -320,11 +570,14 @@ class TelegramBot:
         """Deletes an assessment question by ID (admin only)."""
         user_id = update.effective_user.id
         if user_id not in self.admins:
-            await update.message.reply_text("Sorry, this command is only available for admins.")
+            await update.message.reply_text(ADMIN_ONLY_MSG)
             return
 
         q_id = context.args[0]
-        self.db.delete_q(q_id)
+        question = await self.db.delete_q(q_id)
+        if question is not None:
+            self.questions.remove(int(q_id))
+            await self.teacher.verdicts.invalidate(question)
         await update.message.reply_text(f" The question with id {q_id} is deleted.")
 
 
@@ -333,36 +586,149 @@ class TelegramBot:
         args = context.args
         question = ' '.join(args)
         msg = await update.message.reply_text('Thinking....')
-        answer: str = self.teacher.get_response(question, user_asks=1)
-        
-        await msg.edit_text(answer)
+        reply = StreamingReply(msg, interval=float(os.getenv('STREAM_EDIT_INTERVAL', 1)))
+        try:
+            async for chunk in self.teacher.ask_stream(question):
+                await reply.append(chunk)
+        except asyncio.TimeoutError:
+            if reply.text:
+                await reply.append("\n\nSorry, the rest of the answer is taking too long. Please try again.")
+            else:
+                await reply.append("Sorry, I couldn't come up with an answer in time. Please try again.")
+        except LLMError as e:
+            logging.error(f"Answering a question failed: {str(e)}")
+            separator = "\n\n" if reply.text else ""
+            await reply.append(separator + "Sorry, I can't answer questions right now. Please try again later.")
+        await reply.finish()
 
 
     async def my_level(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Retrieves and displays the user's current learning level."""
         user_id = update.effective_user.id
-        score_level = self.db.get_users(id=user_id) # returns (user_id, score, level)
-        if score_level is None:
+        profile = await self.users.get(user_id)
+        if profile is None:
             await update.message.reply_text(f"Your are not subscribed to the bot.")
             return
         
-        score, level = score_level[1], score_level[2]
-        await update.message.reply_text(f"Your level is {level} with a score of {score}.")
+        await update.message.reply_text(f"Your level is {profile.level} with a score of {profile.score}.")
 
 
     async def get_questions(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Retrieves and displays all available assessment questions (admin only)."""
+        """Shows the question bank a page at a time, optionally only one level (admin only)."""
+        user_id = update.effective_user.id
+        if user_id not in self.admins:
+            await update.message.reply_text(ADMIN_ONLY_MSG)
+            return
+
+        level = context.args[0].lower() if context.args else None
+        text, reply_markup = await self._questions_page(level)
+        await update.message.reply_text(text, reply_markup=reply_markup)
+
+
+    async def questions_page_button(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handles the previous/next buttons under a /get_questions page."""
+        query = update.callback_query
+        if query.from_user.id not in self.admins:
+            await query.answer(ADMIN_ONLY_MSG)
+            return
+        await query.answer()
+
+        _, direction, q_id, level = query.data.split(':', 3)
+        page = {'after': int(q_id)} if direction == 'next' else {'before': int(q_id)}
+        text, reply_markup = await self._questions_page(level or None, **page)
+        try:
+            await query.edit_message_text(text, reply_markup=reply_markup)
+        except BadRequest as e: # the button was pressed twice
+            if 'not modified' not in str(e):
+                raise
+
+
+    async def _questions_page(self, level: str = None, after: int = None, before: int = None):
+        """Text and buttons of a page of questions, or of the first page if that one is now empty."""
+        rows, has_prev, has_next = await self.db.get_questions_page(after, before, QUESTIONS_PAGE_SIZE, level)
+        if not rows and (after or before):
+            rows, has_prev, has_next = await self.db.get_questions_page(limit=QUESTIONS_PAGE_SIZE, q_level=level)
+        if not rows:
+            return "No questions available.", None
+
+        text = "\n".join(f"{q_id}. {textwrap.shorten(question, 180, placeholder='...')} ({q_level})"
+                         for q_id, question, q_level in rows)
+        buttons = []
+        if has_prev:
+            buttons.append(InlineKeyboardButton("« Previous", callback_data=f"qpage:prev:{rows[0][0]}:{level or ''}"))
+        if has_next:
+            buttons.append(InlineKeyboardButton("Next »", callback_data=f"qpage:next:{rows[-1][0]}:{level or ''}"))
+        return text, InlineKeyboardMarkup([buttons]) if buttons else None
+
+
+    async def import_questions(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Adds every question of a CSV or JSONL file sent with /import_q as its caption (admin only)."""
         user_id = update.effective_user.id
-        if user_id in self.admins:
-            questions = self.db.get_questions()        
-            message = "\n".join([f"{q[0]}. {q[1]} ({q[2]})" for q in questions])
+        if user_id not in self.admins:
+            await update.message.reply_text(ADMIN_ONLY_MSG)
+            return
 
+        document = update.message.document
+        fmt = format_of(document.file_name)
+        if fmt is None:
+            await update.message.reply_text("Please send a .csv or .jsonl file.")
+            return
+        if document.file_size and document.file_size > FileSizeLimit.FILESIZE_DOWNLOAD:
+            await update.message.reply_text("The file is too large, bots can only download files up to 20 MB.")
+            return
+
+        imported, errors = 0, []
+        batch_size = int(os.getenv('QUESTION_IMPORT_BATCH', 1000))
+        # spooled to disk past 1 MB and read back a row at a time
+        with tempfile.SpooledTemporaryFile(max_size=1024 * 1024) as raw:
+            await (await document.get_file()).download_to_memory(out=raw)
+            raw.seek(0)
+            rows = read_questions(io.TextIOWrapper(raw, encoding='utf-8-sig', newline=''), fmt, IMPORT_LEVELS, errors)
             try:
-                await update.message.reply_text(message)
-            except BadRequest: # the message is empty
-                await update.message.reply_text("No questions available.")
-        else:
-            await update.message.reply_text("Sorry, this command is only available for admins.")
+                for batch in batched(rows, batch_size):
+                    await self.db.insert_q(batch) # one transaction per batch
+                    await self.teacher.verdicts.invalidate_many([question for question, _ in batch])
+                    imported += len(batch)
+            except UnicodeDecodeError:
+                errors.append((None, "the rest of the file isn't UTF-8 text"))
+
+        await self.questions.refresh()
+
+        lines = [f"Imported {imported} questions."]
+        if errors:
+            lines.append(f"Skipped {len(errors)} rows:")
+            lines += [f"  line {line}: {reason}" if line else f"  {reason}" for line, reason in errors[:10]]
+            if len(errors) > 10:
+                lines.append(f"  and {len(errors) - 10} more")
+        await update.message.reply_text("\n".join(lines))
+
+
+    async def export_questions(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Sends the question bank as a CSV (default) or JSONL file that /import_q reads back (admin only)."""
+        user_id = update.effective_user.id
+        if user_id not in self.admins:
+            await update.message.reply_text(ADMIN_ONLY_MSG)
+            return
+
+        fmt = context.args[0].lower().lstrip('.') if context.args else 'csv'
+        if format_of(f'questions.{fmt}') is None:
+            await update.message.reply_text("Usage: /export_q [csv|jsonl]")
+            return
+
+        with tempfile.SpooledTemporaryFile(max_size=1024 * 1024) as raw:
+            text = io.TextIOWrapper(raw, encoding='utf-8', newline='')
+            writer = QuestionWriter(text, fmt)
+            after, has_next = 0, True
+            while has_next: # a page at a time rather than the whole bank at once
+                rows, _, has_next = await self.db.get_questions_page(after=after, limit=1000)
+                writer.write(rows)
+                after = rows[-1][0] if rows else after
+            text.flush()
+            text.detach()
+
+            raw.seek(0)
+            await update.message.reply_document(document=raw, filename=f'questions.{fmt}',
+                                                caption=f"{writer.count} questions")
 
 
     async def unsubscribe(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -375,88 +741,61 @@ class TelegramBot:
 
     async def top_learners(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Displays the top learners in a formatted table."""
-        top_learners = self.db.get_top_learners()
-        
-        table_lines = ["🏆 Top Learners 🏆"]
-        table_lines.append("```")
-        table_lines.append(f"{'Name':<10} {'Level':<12} {'Score':<5}")
-        table_lines.append("-" * 30)
-        
-        for name, level, score in top_learners:
-            table_lines.append(f"{name:<10} {level:<12} {score:<5}")
-        
-        table_lines.append("```")
-        
-        await update.message.reply_text("\n".join(table_lines), parse_mode='Markdown')
+        table = await self.leaderboard.render()
+        await update.message.reply_text(table, parse_mode='Markdown')
 
 
     async def task_interval(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Updates the frequency of task notifications."""
         user_id = update.effective_user.id
-        interval = context.args[0]
+        if len(context.args) != 1 or not context.args[0].isdecimal() or int(context.args[0]) < 1:
+            await update.message.reply_text("Usage: /task_interval <hours>, e.g. /task_interval 24")
+            return
+        interval = int(context.args[0])
 
-        self.db.update_interval(user_id, interval)
+        await self.users.update_interval(user_id, interval)
 
         await update.message.reply_text(f"You will get a task every {interval} hours.")
 
 
     async def send_daily_task(self, context: ContextTypes.DEFAULT_TYPE):
-        """Send daily tasks to users"""
-        users = self.db.get_users(daily_task=True)
-        current_time = datetime.now()
-
-        for user_id, level, last_assessment, task_interval in users:
-            if isinstance(last_assessment, str):
-                last_assessment = datetime.strptime(last_assessment, "%Y-%m-%d %H:%M:%S.%f")
+        """Send daily tasks to users whose next task is due"""
+        with metrics.scheduler_duration.time():
+            await self._send_due_tasks()
 
-            time_diff = current_time - last_assessment
 
-            if time_diff < timedelta(hours=task_interval):
-                continue
-
-            # Check if user already has an active question
-            result = self.db.execute_query('''
-                SELECT current_question 
-                FROM users 
-                WHERE user_id = ? AND current_question IS NOT NULL
-            ''', (user_id,))
-            
-            if result:
-                continue  # Skip if user already has an active question
+    async def _send_due_tasks(self):
+        current_time = datetime.now()
+        users = await self.db.get_due_users(current_time, self.shard)
+        metrics.scheduler_users.inc(len(users))
+        outbox = []
 
-            questions = self.db.get_questions(q_level=level)
+        for user_id, level in users:
+            picked = await self.questions.sample(level)
 
-            if not questions:
+            if picked is None:
                 logging.warning(f"No questions available for level: {level}")
                 continue
 
-            daily_question = random.choice(questions)[0]
+            _, daily_question = picked
 
-            self.db.execute_query('''
-                UPDATE users 
-                SET current_question = ?,
-                    last_assessment = ?
-                WHERE user_id = ?
-                ''', 
-                (daily_question, current_time, user_id))
+            await self.users.assign_daily_question(user_id, daily_question, current_time)
             
             message = (
                 "🎯 Here's your daily Python challenge!\n\n"
                 f"{daily_question}\n\n"
                 "Reply with your answer or use /skip to skip this question."
             )
-            
-            try:
-                await context.bot.send_message(
-                    chat_id=user_id,
-                    text=message,
-                    parse_mode='HTML'
-                )
-            except Exception as e:
-                logging.error(f"Failed to send message to user {user_id}: {str(e)}")
-                continue
-            
-            await asyncio.sleep(0.5)
+            outbox.append((user_id, message))
+
+        if not outbox:
+            return
+
+        report = await self.dispatcher.send_many(outbox, parse_mode='HTML')
+        logging.info(
+            f"Daily tasks: {report.sent} sent, {report.failed} failed, {report.retries} retries "
+            f"in {report.elapsed:.1f}s ({report.throughput:.1f} msg/s)"
+        )
 
 
     async def handle_daily_answer(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -464,21 +803,28 @@ class TelegramBot:
         user_id = update.effective_user.id
         user_answer = update.message.text
 
-        # Check if user has an active daily task
-        result = self.db.execute_query('''
-            SELECT current_question, score, level 
-            FROM users 
-            WHERE user_id = ? AND current_question IS NOT NULL
-        ''', (user_id,))
-        
-        if not result:
+        # Claim the active daily task, without touching the db if there is none,
+        # so an answer sent twice is only graded once
+        profile = await self.users.take_active_task(user_id)
+        if profile is None:
             # No active daily task, let other handlers process the message
             return
+        current_question, current_score, current_level = profile.current_question, profile.score, profile.level
         
-        current_question, current_score, current_level = result[0]
-        
-        message = f"Question: {current_question}. User Answer: {user_answer}"
-        status = self.teacher.get_response(message)
+        try:
+            status = await self.teacher.grade(current_question, user_answer)
+        except asyncio.TimeoutError:
+            self.users.restore_active_task(user_id)
+            await update.message.reply_text(GRADING_TIMEOUT_MSG)
+            return
+        except LLMError as e:
+            logging.error(f"Grading failed for user {user_id}: {str(e)}")
+            self.users.restore_active_task(user_id)
+            await update.message.reply_text(GRADING_FAILED_MSG)
+            return
+        except Exception: # e.g. a provider error that isn't retried, so the task isn't lost
+            self.users.restore_active_task(user_id)
+            raise
         score_change = score_weights.get(current_level, 1)
 
         if status == 1:
@@ -495,18 +841,10 @@ class TelegramBot:
             )
 
         new_level = self.level_by_score(new_score)
-        is_expert = new_level == 'advanced'
-        self.db.execute_query('''
-            UPDATE users 
-            SET score = ?,
-                current_question = NULL,
-                last_assessment = ?,
-                level = ?,
-                is_expert = ?
-            WHERE user_id = ?
-        ''', (new_score, datetime.now(), new_level, is_expert, user_id))
-
-        self.db.insert_assesment(
+        await self.users.record_daily_answer(user_id, new_score, new_level, datetime.now())
+        self.leaderboard.update(user_id, new_score, new_level)
+
+        await self.assessments.add(
             user_id, 
             current_question, 
             user_answer, 
@@ -519,25 +857,115 @@ class TelegramBot:
         """Handle skipping of daily tasks."""
         user_id = update.effective_user.id
         
-        result = self.db.execute_query('''
-            SELECT current_question 
-            FROM users 
-            WHERE user_id = ? AND current_question IS NOT NULL
-        ''', (user_id,))
-        
-        if not result:
+        if not self.users.has_active_task(user_id):
             await update.message.reply_text("You don't have an active daily task to skip!")
             return
         
-        self.db.execute_query('''
-            UPDATE users 
-            SET current_question = NULL
-            WHERE user_id = ?
-        ''', (user_id,))
+        await self.users.clear_active_question(user_id)
         
         await update.message.reply_text("Daily task skipped. Wait for the next one!")
     
 
+    async def stats(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Shows latency percentiles and cache statistics (admin only)."""
+        user_id = update.effective_user.id
+        if user_id not in self.admins:
+            await update.message.reply_text(ADMIN_ONLY_MSG)
+            return
+
+        lines = []
+        if metrics.enabled:
+            for title, histogram in (("Handlers", metrics.handler_latency),
+                                     ("LLM calls", metrics.llm_latency),
+                                     ("Database", metrics.db_latency)):
+                lines.append(f"{title} (count / mean / p95 ms):")
+                for (label, ), (count, mean, p95) in sorted(histogram.summary().items()):
+                    lines.append(f"  {label}: {count} / {mean * 1000:.1f} / {p95 * 1000:.0f}")
+        else:
+            lines.append("Latency metrics are disabled, set METRICS_ENABLED=1 to collect them.")
+
+        lines.append(f"Local grading: {self.teacher.pregrader.stats()}")
+        lines.append(f"Verdict cache: {self.teacher.verdicts.stats()}")
+        lines.append(f"Answer cache: {self.teacher.answers.stats()}")
+        lines.append(f"Assessment writes: {self.assessments.stats()}")
+        await update.message.reply_text("\n".join(lines))
+
+
+    async def question_stats(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Lists the hardest and easiest questions by recent correct rate (admin only)."""
+        user_id = update.effective_user.id
+        if user_id not in self.admins:
+            await update.message.reply_text(ADMIN_ONLY_MSG)
+            return
+
+        count = min(int(context.args[0]), 20) if context.args and context.args[0].isdigit() else 5
+        lines = []
+        for title, hardest in (("Hardest", True), ("Easiest", False)):
+            rows = await self.db.get_question_stats(count, self.questions.min_attempts, hardest)
+            lines.append(f"{title} questions (recently correct / all time):")
+            lines += [f"{q_id}. {textwrap.shorten(question, 100, placeholder='...')} ({q_level}): "
+                      f"{rate:.0%} / {correct}/{attempts}"
+                      for q_id, question, q_level, attempts, correct, rate in rows]
+            if not rows:
+                lines.append(f"  No question has {self.questions.min_attempts} answers yet.")
+        await update.message.reply_text("\n".join(lines))
+
+
+    @staticmethod
+    def webhook_settings() -> dict:
+        """Webhook options from the environment, or None to use long polling.
+
+        WEBHOOK_URL is the public URL Telegram posts updates to. Behind a reverse
+        proxy the local path can differ from it, so it's set by WEBHOOK_PATH and
+        defaults to the URL's own path.
+        """
+        webhook_url = os.getenv('WEBHOOK_URL')
+        if not webhook_url:
+            return None
+
+        secret_token = os.getenv('WEBHOOK_SECRET')
+        if not secret_token:
+            logging.warning("WEBHOOK_SECRET is not set, anyone who finds the webhook URL can send updates")
+
+        return {
+            'listen': os.getenv('WEBHOOK_LISTEN', '0.0.0.0'),
+            'port': int(os.getenv('WEBHOOK_PORT', 8443)),
+            'url_path': os.getenv('WEBHOOK_PATH', urlparse(webhook_url).path).lstrip('/'),
+            'webhook_url': webhook_url,
+            'secret_token': secret_token,
+            'max_connections': int(os.getenv('WEBHOOK_MAX_CONNECTIONS', 40)),
+        }
+
+
+    async def _run_worker(self):
+        index, count = self.shard
+        host, port = worker_address(index)
+        receiver = UpdateReceiver(self.application, host, port, os.getenv('WEBHOOK_SECRET'))
+
+        await self.application.initialize()
+        await self._post_init(self.application)
+        await self.application.start()
+        receiver.start()
+        logging.info(f"======== Worker {index + 1}/{count} is running ========")
+        try:
+            await wait_for_signal()
+        finally:
+            await receiver.stop()
+            await self.application.stop()
+            await self.application.shutdown()
+            await self._post_shutdown(self.application)
+
+
     def run(self):
+        if self.shard is not None:
+            asyncio.run(self._run_worker())
+            return
+
         logging.info("======== Bot is running ========")
-        self.application.run_polling()
+        webhook = self.webhook_settings()
+        if webhook is None:
+            self.application.run_polling()
+            return
+
+        logging.info(f"Receiving updates on {webhook['listen']}:{webhook['port']}/{webhook['url_path']}")
+        self.application.run_webhook(**webhook)
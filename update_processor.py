@@ -0,0 +1,45 @@
+import asyncio
+from typing import Any, Awaitable
+from telegram.ext import BaseUpdateProcessor
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Processes updates of different users concurrently, and those of one user one at a time.
+
+    Grading awaits the LLM, so updates have to overlap for the bot to keep up.
+    But the assessment conversation and the daily task handlers read a user's
+    state, await the grading and then write the state back, which only works if
+    the same user's next update waits for that. Each user's updates therefore
+    run in the order they arrived, behind an asyncio.Lock held only while that
+    user has updates in flight.
+
+    An update waiting for its user's lock counts towards `max_concurrent_updates`.
+    """
+
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max_concurrent_updates)
+        self._locks = {} # user_id -> (lock, number of updates holding or waiting for it)
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        user = getattr(update, 'effective_user', None)
+        if user is None: # e.g. channel posts and polls, which belong to no user
+            await coroutine
+            return
+
+        lock, users = self._locks.get(user.id, (asyncio.Lock(), 0))
+        self._locks[user.id] = (lock, users + 1)
+        try:
+            async with lock:
+                await coroutine
+        finally:
+            lock, users = self._locks[user.id]
+            if users == 1:
+                del self._locks[user.id]
+            else:
+                self._locks[user.id] = (lock, users - 1)
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass